@@ -0,0 +1,60 @@
+
+# usage: python benchmarks/bench_background.py [--objects N --verts N --slice S]
+#
+# Exports a synthetic scene at once, then as a background export stepped in
+# slices of --slice seconds the way the export operator's timer does, and
+# reports the longest the main thread was kept busy by one step.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--verts', type=int, default=10000)
+    parser.add_argument('--slice', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    scene = synthetic.scene(args.objects, args.verts, args.verts, materials=4, nodes=4)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(tmpdir, 'scene.xml')
+        start = time.perf_counter()
+        export_cycles.export_scene(filepath, scene, workers=args.workers)
+        print('at once      %7.2f s' % (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        export = export_cycles.BackgroundExport(filepath, scene, workers=args.workers)
+        steps, longest = 0, 0.0
+        while True:
+            step = time.perf_counter()
+            more = export.step(args.slice)
+            longest = max(longest, time.perf_counter() - step)
+            steps += 1
+            if not more and not export.writing():
+                break
+            # the interface's share of the timer
+            time.sleep(args.slice)
+        export.finish()
+        print('background   %7.2f s %6d steps, longest %.3f s' % (
+            time.perf_counter() - start, steps, longest))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
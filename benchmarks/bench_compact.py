@@ -0,0 +1,61 @@
+
+# usage: python benchmarks/bench_compact.py [--objects N --verts N]
+#
+# Exports a reference synthetic scene with the default and the compact output
+# profiles, and reports how much smaller the files get, and how long they take
+# to write and to parse back.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as etree
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+variants = (
+    ('default', {}),
+    ('default, unindented', { 'indent': False, 'format_xml': False }),
+    ('compact', { 'output': 'compact' }),
+    ('compact, 3 decimals', { 'output': 'compact', 'decimals': 3 }),
+    ('compact, 7 digits', { 'output': 'compact', 'decimals': None, 'precision': 7 }),
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=10)
+    parser.add_argument('--verts', type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    scene = synthetic.scene(args.objects, args.verts, args.verts, materials=4, nodes=4)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        reference = None
+        for name, options in variants:
+            filepath = os.path.join(tmpdir, 'scene.xml')
+            start = time.perf_counter()
+            export_cycles.export_scene(filepath, scene, **options)
+            written = time.perf_counter() - start
+            start = time.perf_counter()
+            etree.parse(filepath)
+            parsed = time.perf_counter() - start
+
+            size = os.path.getsize(filepath)
+            reference = reference or size
+            print('%-22s %9.2f MB %6.1f%% smaller %7.2f s export %7.2f s parse' % (
+                name, size / (1 << 20), 100.0 * (1 - size / reference), written, parsed))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+
+# usage: python benchmarks/bench_cull.py [--objects N --verts N --spread N]
+#
+# Scatters objects over a square of --spread units under the camera, and
+# exports them with and without view culling: reports how many objects were
+# culled, how many meshes were evaluated, and the export time and size.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+variants = (
+    ('no culling', {}),
+    ('culling', { 'cull': True }),
+    ('culling, no margin', { 'cull': True, 'cull_margin': 0.0 }),
+    ('culling, 60 units', { 'cull': True, 'cull_distance': 60.0 }),
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=100)
+    parser.add_argument('--verts', type=int, default=400)
+    parser.add_argument('--spread', type=float, default=200.0)
+    args = parser.parse_args(argv)
+
+    scene = synthetic.scene(args.objects, args.verts, args.verts, materials=4, nodes=4)
+    rnd = random.Random(0)
+    for obj in scene.objects:
+        obj.matrix_world = standin.Matrix.Translation((
+            rnd.uniform(-0.5, 0.5) * args.spread, rnd.uniform(-0.5, 0.5) * args.spread,
+            rnd.uniform(-20.0, 0.0)))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(tmpdir, 'scene.xml')
+        for name, options in variants:
+            start = time.perf_counter()
+            report = export_cycles.export_scene(filepath, scene, stats=True, **options)
+            seconds = time.perf_counter() - start
+            stats = report['stats']
+            print('%-20s %5d culled %5d meshes %7.2f s %9.2f MB' % (
+                name, len(stats['culled']), stats['counters'].get('meshes', 0),
+                seconds, os.path.getsize(filepath) / (1 << 20)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
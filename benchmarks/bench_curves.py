@@ -0,0 +1,64 @@
+
+# usage: python benchmarks/bench_curves.py [--counts 1000 2000 4000] [--keys 8]
+#
+# Exports cables and hair as <curves>, at growing counts, and reports the size
+# of the output and the peak memory of the export per curve key. Both should
+# stay about constant: they scale with the keys, not with tessellated triangles.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+
+def curve_scene(kind, count, keys):
+    scene = synthetic.scene(objects=1, verts=100, faces=100, materials=1, nodes=1)
+    emitter = scene.objects[0]
+    if kind == 'hair':
+        emitter.particle_systems.append(synthetic.hair('Hair', count, keys))
+    else:
+        curve = synthetic.cable('Cable', count, keys, bezier=kind == 'bezier')
+        curve.resolution_u = 4
+        scene.objects.append(standin.Object('Cable', 'CURVE', curve))
+    return scene
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 2000, 4000])
+    parser.add_argument('--keys', type=int, default=8, help='keys per curve or hair')
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for kind in ('poly', 'bezier', 'hair'):
+            for count in args.counts:
+                scene = curve_scene(kind, count, args.keys)
+                filepath = os.path.join(tmpdir, 'scene.xml')
+                tracemalloc.start()
+                start = time.perf_counter()
+                report = export_cycles.export_scene(filepath, scene, curves=True, stats=True)
+                seconds = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                keys = report['stats']['counters']['keys']
+                print('%-7s %7d curves %9d keys %6.1f bytes/key %6.1f peak bytes/key %7.2f s' % (
+                    kind, count, keys, os.path.getsize(filepath) / keys, peak / keys, seconds))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+
+# usage: python benchmarks/bench_instances.py [--counts 1000 10000 100000]
+#
+# Scatters one pebble mesh on the vertices of an object, and from a particle
+# system, at growing counts. Reports the bytes written and the time per
+# instance, and how many meshes were evaluated: the pebble should be
+# serialized once, whatever the count.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--verts', type=int, default=500, help='vertices of the pebble')
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for mode in ('VERTS', 'PARTICLES'):
+            for count in args.counts:
+                scene = synthetic.scene(objects=0, materials=1, nodes=1)
+                pebble = standin.Object('Pebble', 'MESH',
+                                        synthetic.grid_mesh('Pebble', args.verts, args.verts))
+                scene.objects += [pebble, synthetic.scatter('Scatter', pebble, count, mode)]
+
+                filepath = os.path.join(tmpdir, 'scene.xml')
+                start = time.perf_counter()
+                report = export_cycles.export_scene(filepath, scene, stats=True)
+                seconds = time.perf_counter() - start
+                counters = report['stats']['counters']
+                size = os.path.getsize(filepath)
+                print('%-9s %7d instances %8.1f bytes %8.2f us per instance, %d meshes evaluated' % (
+                    mode, counters['instances'], size / count, 1e6 * seconds / count,
+                    counters['meshes']))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+
+# usage: python benchmarks/bench_memory.py [--objects 5 10 20 40] [--budget MB] [--keep-meshes]
+#
+# Exports synthetic scenes of a growing number of objects and reports the
+# peak memory the export allocated, and the evaluated meshes it left behind.
+# Peak memory has to stay flat as the object count grows: exits with status
+# 1 when the largest scene needs more than --threshold times the smallest's.
+# --keep-meshes leaves evaluated meshes in bpy.data.meshes, as the exporter
+# used to, to compare.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import standin
+import synthetic
+
+bpy = standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+
+def measure(objects, verts, options):
+    scene = synthetic.scene(objects, verts, verts, materials=4, nodes=4)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        tracemalloc.start()
+        export_cycles.export_scene(os.path.join(tmpdir, 'scene.xml'), scene, **options)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(tmpdir)
+    left = len(bpy.data.meshes)
+    del bpy.data.meshes[:]
+    return peak / (1 << 20), left
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, nargs='+', default=[5, 10, 20, 40])
+    parser.add_argument('--verts', type=int, default=5000)
+    parser.add_argument('--includes', action='store_true', help='meshes to include files')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--budget', type=int, help="_options['memory_budget'], in MB")
+    parser.add_argument('--threshold', type=float, default=1.5)
+    parser.add_argument('--keep-meshes', action='store_true')
+    args = parser.parse_args(argv)
+
+    options = { 'export_mesh': not args.includes, 'workers': args.workers }
+    if args.budget is not None:
+        options['memory_budget'] = args.budget << 20
+    if args.keep_meshes:
+        bpy.data.meshes.remove = lambda mesh, *args, **kwargs: None
+
+    peaks = []
+    for objects in args.objects:
+        peak, left = measure(objects, args.verts, options)
+        peaks.append(peak)
+        print('%5d objects %9.1f MB peak %5d meshes left' % (objects, peak, left))
+
+    growth = peaks[-1] / peaks[0]
+    print('peak grew %.2fx for %.0fx the objects' % (growth, args.objects[-1] / args.objects[0]))
+    return 1 if growth > args.threshold else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
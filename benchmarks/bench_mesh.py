@@ -0,0 +1,89 @@
+
+# usage: blender -b my_file.blend -P benchmarks/bench_mesh.py
+#
+# Times gen_mesh against the per-element implementation it replaced, on every
+# mesh object of the current scene, and checks that both produce the same bytes
+# from tessfaces. Also times evaluating the mesh with and without tessfaces,
+# and gen_mesh reading polygons and loops instead.
+
+import time
+
+import bpy
+
+from io_scene_cycles import export_cycles
+from io_scene_cycles.export_cycles import gen_list
+
+
+def gen_mesh_reference(ctx, mesh):
+    col_align = ctx.options['format_xml']
+    head = '<mesh P'
+    sp  = 6 if col_align else 1
+
+    funcformat = lambda P: ' '.join( ' '.join((str(v.co.x),str(v.co.y),str(v.co.z))) for v in P )
+    yield from gen_list(ctx, mesh.vertices, funcformat, head, col_align, 3)
+
+    head = ' '*sp + 'nverts'
+    funcformat = lambda faces: ' '.join( str(len(f.vertices)) for f in faces)
+    yield from gen_list(ctx, mesh.tessfaces, funcformat, head, col_align, 50)
+
+    head = ' '*sp+'verts'
+    funcformat = lambda faces: ' '.join( ' '.join( str(i) for i in f.vertices ) for f in faces)
+    yield from gen_list(ctx, mesh.tessfaces, funcformat, head, col_align, 5)
+
+    uvmap = [m for m in mesh.tessface_uv_textures if m.active_render]
+    if len(uvmap):
+        uvmap = uvmap[0].data
+        head = ' '*sp+'UV'
+        funcformat = lambda uvmap: ' '.join( ' '.join(str(c[0])+' '+str(c[1]) for c in f.uv) for f in uvmap )
+        yield from gen_list(ctx, uvmap, funcformat, head, col_align, 1)
+
+    yield '/>'+ctx.NL
+
+
+def timed(gen, ctx, mesh):
+    start = time.perf_counter()
+    text = ''.join(gen(ctx, mesh))
+    return time.perf_counter() - start, text
+
+
+def evaluate(obj, scene, calc_tessface):
+    start = time.perf_counter()
+    mesh = obj.to_mesh(scene, True, 'PREVIEW', calc_tessface=calc_tessface)
+    return time.perf_counter() - start, mesh
+
+
+def rate(nverts, seconds):
+    return nverts/max(seconds, 1e-9)
+
+
+scene = bpy.context.scene
+polygons = export_cycles.ExportContext({'mesh_source': 'polygons'})
+tessfaces = export_cycles.ExportContext({'mesh_source': 'tessfaces'})
+keys = ('before', 'after', 'polygons', 'to_mesh', 'to_mesh_polygons')
+total = dict.fromkeys(keys, 0.0)
+total['verts'] = 0
+
+print('%-30s %10s %12s %12s %12s %12s %12s' % (('', 'verts') + keys))
+for obj in scene.objects:
+    if obj.type != 'MESH':
+        continue
+    times = {}
+    times['to_mesh_polygons'], mesh = evaluate(obj, scene, False)
+    times['polygons'], text = timed(export_cycles.gen_mesh, polygons, mesh)
+    bpy.data.meshes.remove(mesh)
+
+    times['to_mesh'], mesh = evaluate(obj, scene, True)
+    times['before'], expected = timed(gen_mesh_reference, tessfaces, mesh)
+    times['after'], text = timed(export_cycles.gen_mesh, tessfaces, mesh)
+    assert text == expected, 'gen_mesh output differs for %s' % obj.name
+    bpy.data.meshes.remove(mesh)
+
+    nverts = len(obj.data.vertices)
+    total['verts'] += nverts
+    for key in keys:
+        total[key] += times[key]
+    print('%-30s %10d %12.0f %12.0f %12.0f %12.0f %12.0f verts/s' % (
+        (obj.name, nverts) + tuple(rate(nverts, times[key]) for key in keys)))
+
+print('%-30s %10d %12.0f %12.0f %12.0f %12.0f %12.0f verts/s' % (
+    ('total', total['verts']) + tuple(rate(total['verts'], total[key]) for key in keys)))
@@ -0,0 +1,35 @@
+
+# usage: python benchmarks/bench_nodes.py
+#
+# Times nodes.write_material on synthetic node graphs of growing size. The
+# time per link should stay flat if the translation scales linearly.
+
+import math
+import time
+
+from standin import import_module
+from synthetic import node_material
+
+
+def main():
+    nodes = import_module('nodes')
+    results = []
+    for size in (100, 200, 400, 800, 1600, 3200):
+        material = node_material('Synthetic', size)
+        nlinks = len(material.node_tree.links)
+        best = float('inf')
+        for repeat in range(3):
+            start = time.perf_counter()
+            nodes.write_material(material)
+            best = min(best, time.perf_counter() - start)
+        results.append((nlinks, best))
+        print('%6d nodes %6d links %9.2f ms %8.2f us/link' % (
+            len(material.node_tree.nodes), nlinks, best*1e3, best/nlinks*1e6))
+
+    # slope of log(time) over log(links): 1 is linear, 2 quadratic
+    (n0, t0), (n1, t1) = results[0], results[-1]
+    print('scaling exponent: %.2f' % (math.log(t1/t0) / math.log(n1/n0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+
+# usage: python benchmarks/bench_plan.py [--objects N --verts N]
+#
+# Calibrates a profile by exporting a small synthetic scene, then plans a
+# bigger one with it and exports that too: reports the projected and the
+# actual bytes and seconds, and how long planning took.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles, plan
+
+
+def scene(objects, verts, seed):
+    result = synthetic.scene(objects, verts, verts, materials=4, nodes=4, shared=0.25)
+    pebble = standin.Object('Pebble', 'MESH', synthetic.grid_mesh('Pebble', 200, 200))
+    result.objects += [pebble, synthetic.scatter('Scatter', pebble, 10 * objects, 'VERTS')]
+    rnd = random.Random(seed)
+    for obj in result.objects[:objects]:
+        obj.matrix_world = standin.Matrix.Translation((rnd.uniform(-80, 80),
+                                                       rnd.uniform(-30, 30), 0))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=40)
+    parser.add_argument('--verts', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        profile_path = os.path.join(tmpdir, 'profile.json')
+        start = time.perf_counter()
+        plan.calibrate(scene(max(1, args.objects // 8), args.verts // 4, 1),
+                       os.path.join(tmpdir, 'calibration.xml'), save=profile_path)
+        print('calibrated in %.2f s' % (time.perf_counter() - start))
+
+        big = scene(args.objects, args.verts, 2)
+        report = plan.plan_scene(big, profile_path)
+        filepath = os.path.join(tmpdir, 'scene.xml')
+        start = time.perf_counter()
+        export_cycles.export_scene(filepath, big)
+        seconds = time.perf_counter() - start
+        size = plan.measure_output(filepath)['bytes']
+
+        total = report['total']
+        print('planned in %.3f s: %d objects, %d verts, %d faces, %d instances, %d nodes' % (
+            report['plan_seconds'], total['objects'], total['verts'], total['faces'],
+            total['instances'], total['nodes']))
+        print('%-10s %12s %12s %8s' % ('', 'projected', 'actual', 'error'))
+        for name, projected, actual in (('MB', total['bytes'] / (1 << 20), size / (1 << 20)),
+                                        ('seconds', total['seconds'], seconds)):
+            print('%-10s %12.2f %12.2f %7.1f%%' % (
+                name, projected, actual, 100 * (projected - actual) / actual))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+
+# usage: python benchmarks/bench_preview.py [--objects N --verts N]
+#
+# Exports a synthetic scene at final quality, at preview quality, and at
+# preview quality decimated to a face budget per object and per scene:
+# reports the faces written, the faces decimation removed, and the export
+# time and size. The stand-in's decimation only drops faces, it doesn't cost
+# what blender's does.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+
+def variants(faces):
+    ''' faces is the scene's total '''
+    return (
+        ('final', { 'preview': False }),
+        ('preview', {}),
+        ('preview, 2000 per object', { 'face_budget': 2000 }),
+        ('preview, 10% of scene', { 'scene_face_budget': faces // 10 }),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=30)
+    parser.add_argument('--verts', type=int, default=40000)
+    args = parser.parse_args(argv)
+
+    scene = synthetic.scene(args.objects, args.verts, args.verts, materials=4, nodes=4)
+    faces = sum(len(obj.data.polygons) for obj in scene.objects if obj.type == 'MESH')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(tmpdir, 'scene.xml')
+        for name, options in variants(faces):
+            start = time.perf_counter()
+            report = export_cycles.export_scene(filepath, scene, stats=True,
+                                                instance_meshes=False, **options)
+            seconds = time.perf_counter() - start
+            counters = report['stats']['counters']
+            print('%-26s %9d faces %9d decimated %7.2f s %9.2f MB' % (
+                name, counters.get('faces', 0), counters.get('decimated_faces', 0),
+                seconds, os.path.getsize(filepath) / (1 << 20)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+
+# usage: python benchmarks/bench_stream.py [--objects N --verts N]
+#
+# Exports a synthetic scene to a file that the stand-in consumer
+# (consumer.py) reads once written, then streams it to the consumer through
+# a pipe and a unix socket. Reports how long after the export started the
+# consumer got the film, the first shader and the first mesh, and was done.
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+CONSUMER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'consumer.py')
+
+
+def to_file(scene, tmpdir):
+    filepath = os.path.join(tmpdir, 'scene.xml')
+    export_cycles.export_scene(filepath, scene)
+    with open(filepath, 'rb') as fp:
+        consumer = subprocess.run([sys.executable, CONSUMER], stdin=fp,
+                                  stdout=subprocess.PIPE, check=True)
+    return consumer.stdout
+
+
+def to_pipe(scene, tmpdir):
+    consumer = subprocess.Popen([sys.executable, CONSUMER], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+    export_cycles.export_stream(consumer.stdin, scene, os.path.join(tmpdir, 'pipe.xml'))
+    return consumer.communicate()[0]
+
+
+def to_socket(scene, tmpdir):
+    path = os.path.join(tmpdir, 'consumer.sock')
+    consumer = subprocess.Popen([sys.executable, CONSUMER, '--unix', path],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sink:
+        sink.connect(path)
+        export_cycles.export_stream(sink, scene, os.path.join(tmpdir, 'socket.xml'))
+    return consumer.communicate()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--verts', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    scene = synthetic.scene(args.objects, args.verts, args.verts, materials=4, nodes=4)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('%-8s %8s %8s %8s %8s %9s' % ('', 'film', 'shader', 'mesh', 'done', 'MB'))
+        for name, func in (('file', to_file), ('pipe', to_pipe), ('socket', to_socket)):
+            start = time.time()
+            report = json.loads(func(scene, tmpdir))
+            offset = report['started'] - start
+            first = report['first']
+            print('%-8s %7.2fs %7.2fs %7.2fs %7.2fs %9.2f' % (
+                name, offset + first['film'], offset + first['shader'], offset + first['mesh'],
+                offset + report['seconds'], report['bytes'] / (1 << 20)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
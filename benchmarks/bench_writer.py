@@ -0,0 +1,75 @@
+
+# usage: python benchmarks/bench_writer.py [megabytes]
+#
+# Measures how fast util.writer gets a stream of mesh-like lines to disk,
+# compared to writing every line on its own, for plain and compressed output.
+
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+
+from standin import import_module
+
+
+def unbuffered_writer(filepath):
+    # util.writer before it batched its input
+    with open(filepath, 'w') as fp:
+        while True:
+            data = yield
+            if not data : break
+            fp.write(data)
+
+
+def mesh_lines(megabytes):
+    ''' lines of 3 float32 vertices, the way gen_mesh writes P '''
+    rnd = random.Random(0)
+    as_float32 = lambda x: struct.unpack('f', struct.pack('f', x))[0]
+    lines = []
+    size = 0
+    while size < megabytes * (1 << 20):
+        line = ' '.join(str(as_float32(rnd.uniform(-10, 10))) for i in range(9)) + '\n'
+        lines.append(line)
+        size += len(line)
+    return lines
+
+
+def run(make_writer, filepath, lines, chunked):
+    megabytes = sum(map(len, lines)) / (1 << 20)
+    if chunked:
+        # gen_mesh hands over about 64k of lines at a time
+        lines = [''.join(lines[i:i+256]) for i in range(0, len(lines), 256)]
+    start = time.perf_counter()
+    f = make_writer(filepath)
+    next(f)
+    for data in lines:
+        f.send(data)
+    f.close()
+    elapsed = time.perf_counter() - start
+    return megabytes / elapsed, os.path.getsize(filepath)
+
+
+def main():
+    util = import_module('util')
+    lines = mesh_lines(int(sys.argv[1]) if len(sys.argv) > 1 else 64)
+    directory = tempfile.mkdtemp()
+
+    cases = (
+        ('line per write', unbuffered_writer, '.xml', False),
+        ('util.writer, lines', util.writer.__wrapped__, '.xml', False),
+        ('util.writer, chunks', util.writer.__wrapped__, '.xml', True),
+        ('util.writer, chunks, gzip', util.writer.__wrapped__, '.xml.gz', True),
+        ('util.writer, chunks, xz', util.writer.__wrapped__, '.xml.xz', True),
+    )
+    for name, make_writer, ext, chunked in cases:
+        filepath = os.path.join(directory, 'bench' + ext)
+        speed, size = run(make_writer, filepath, lines, chunked)
+        print('%-28s %8.1f MB/s %10.1f MB on disk' % (name, speed, size / (1 << 20)))
+        os.remove(filepath)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
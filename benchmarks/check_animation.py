@@ -0,0 +1,103 @@
+# usage: python benchmarks/check_animation.py [--frames N --verts N]
+#
+# Exports an animation of deforming geometry: two objects sharing a mesh, a
+# group instance of a deforming member and particles instancing a deforming
+# object. Checks the geometry every frame file includes matches what
+# exporting the scene on its own at that frame writes. Exits with status 1
+# on the first frame that differs.
+
+import argparse
+import array
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles, validate
+
+
+def deforming(obj):
+    obj.deforming = True
+    return obj
+
+
+def animated_scene(verts):
+    ''' the scene, and the meshes whose vertices move with the frame '''
+    scene = synthetic.scene(4, verts, verts, materials=2, nodes=2, shared=0.5)
+    for obj in scene.objects[:2]:
+        deforming(obj)
+    member = deforming(standin.Object('Member', 'MESH',
+                                      synthetic.grid_mesh('Member', verts, verts, seed=7)))
+    group = standin.Object('Group', 'EMPTY', None, standin.Matrix.Translation((0.0, 5.0, 0.0)))
+    group.dupli_type = 'GROUP'
+    group.dupli_group = types.SimpleNamespace(objects=[member])
+    pebble = deforming(standin.Object('Pebble', 'MESH',
+                                      synthetic.grid_mesh('Pebble', verts, verts, seed=8)))
+    scatter = synthetic.scatter('Scatter', pebble, 5, 'PARTICLES')
+    scene.objects += [group, scatter]
+    meshes = [scene.objects[0].data, member.data, pebble.data]
+    return scene, meshes
+
+
+def animate(scene, meshes):
+    rest = { mesh: mesh.vertices._attrs['co'][0][:] for mesh in meshes }
+
+    def frame_set(frame):
+        scene.frame_current = frame
+        for mesh, co in rest.items():
+            moved = array.array('f', co)
+            moved[2::3] = array.array('f', (z + 0.25 * frame for z in co[2::3]))
+            mesh.vertices._attrs['co'] = (moved, 3)
+    scene.frame_set = frame_set
+
+
+def geometry(filepath):
+    ''' the P of every mesh filepath writes, includes followed, sorted '''
+    found = []
+
+    def collect(element):
+        for child in element.iter():
+            if child.tag == 'mesh':
+                found.append(child.get('P'))
+            elif child.tag == 'include':
+                for included in validate.parse_include(filepath, child):
+                    collect(included)
+
+    for element, path in validate.records(filepath):
+        collect(element)
+    return sorted(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=3)
+    parser.add_argument('--verts', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    scene, meshes = animated_scene(args.verts)
+    animate(scene, meshes)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        export_cycles.export_animation(os.path.join(tmpdir, 'anim.xml'), scene, 1, args.frames)
+        for frame in range(1, args.frames + 1):
+            scene.frame_set(frame)
+            expected = os.path.join(tmpdir, 'frame%d.xml' % frame)
+            export_cycles.export_scene(expected, scene)
+            if geometry(os.path.join(tmpdir, 'anim_%04d.xml' % frame)) != geometry(expected):
+                print('frame %d: the animation writes other geometry than the scene' % frame)
+                return 1
+        print('%d frames of deforming geometry matched' % args.frames)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
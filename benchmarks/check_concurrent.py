@@ -0,0 +1,86 @@
+
+# usage: python benchmarks/check_concurrent.py [--objects N --verts N --rounds N]
+#
+# Runs exports with different options at the same time, from threads of one
+# process, and checks every file matches what the same export writes on its
+# own. Exits with status 1 on the first difference.
+
+import argparse
+import concurrent.futures
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles
+
+variants = (
+    ('default', {}),
+    ('compact', { 'output': 'compact' }),
+    ('includes', { 'export_mesh': False }),
+    ('triangles', { 'triangles': True, 'normals': True, 'precision': 6 }),
+    ('unwrapped', { 'wrap': False, 'tabsize': 4 }),
+    ('workers', { 'workers': 2, 'export_mesh': False }),
+    ('stats', { 'stats': True, 'decimals': 2 }),
+)
+
+
+def export(tmpdir, name, options, args):
+    # a scene of its own: blender's dupli lists are not for two threads
+    scene = synthetic.scene(args.objects, args.verts, args.verts, materials=4, nodes=4)
+    export_cycles.export_scene(os.path.join(tmpdir, name + '.xml'), scene, **options)
+
+
+def same(expected, actual, name):
+    ''' True when the export of `name` and its includes match '''
+    if not filecmp.cmp(os.path.join(expected, name + '.xml'),
+                       os.path.join(actual, name + '.xml'), shallow=False):
+        return False
+    meshes = os.path.join(expected, name + '_meshes')
+    if not os.path.isdir(meshes):
+        return True
+    compared = filecmp.dircmp(meshes, os.path.join(actual, name + '_meshes'))
+    return not (compared.left_only or compared.right_only or compared.diff_files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=6)
+    parser.add_argument('--verts', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    expected = tempfile.mkdtemp()
+    try:
+        for name, options in variants:
+            export(expected, name, options, args)
+
+        for round in range(args.rounds):
+            actual = tempfile.mkdtemp()
+            try:
+                with concurrent.futures.ThreadPoolExecutor(len(variants)) as pool:
+                    jobs = [pool.submit(export, actual, name, options, args)
+                            for name, options in variants]
+                    for job in jobs:
+                        job.result()
+                for name, options in variants:
+                    if not same(expected, actual, name):
+                        print('round %d: %s differs from its export on its own' % (round, name))
+                        return 1
+            finally:
+                shutil.rmtree(actual)
+        print('%d rounds of %d concurrent exports matched' % (args.rounds, len(variants)))
+    finally:
+        shutil.rmtree(expected)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+
+# usage: python benchmarks/consumer.py [--listen HOST:PORT | --unix PATH]
+#
+# A stand-in for a renderer reading a streamed export: parses the xml as it
+# arrives, on stdin or from one connection to a socket, and prints as json
+# when the film, the camera, the first shader and the first mesh arrived,
+# in seconds since the first byte (received at time.time() 'started'), with
+# the count of every element. Only the element being read is held in memory.
+
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+import xml.etree.ElementTree as etree
+
+MILESTONES = ('film', 'camera', 'shader', 'mesh')
+
+
+def consume(read, bufsize=1 << 16):
+    ''' parses what read(bufsize) returns until it returns nothing '''
+    parser = etree.XMLPullParser(events=('start', 'end'))
+    report = { 'bytes': 0, 'counts': {}, 'first': {} }
+    start = None
+    root = None
+    depth = 0
+    while True:
+        data = read(bufsize)
+        if not data:
+            break
+        if start is None:
+            start = time.perf_counter()
+            report['started'] = time.time()
+        report['bytes'] += len(data)
+        parser.feed(data)
+        for event, element in parser.read_events():
+            if event == 'start':
+                if depth == 0:
+                    root = element
+                depth += 1
+                counts = report['counts']
+                counts[element.tag] = counts.get(element.tag, 0) + 1
+                if element.tag in MILESTONES and element.tag not in report['first']:
+                    report['first'][element.tag] = time.perf_counter() - start
+            else:
+                depth -= 1
+                if depth == 1:
+                    # done with a child of <cycles>
+                    root.clear()
+    parser.close()
+    report['seconds'] = time.perf_counter() - start if start is not None else 0.0
+    return report
+
+
+def accept(family, address):
+    ''' the first connection to a socket listening on address '''
+    server = socket.socket(family, socket.SOCK_STREAM)
+    server.bind(address)
+    server.listen(1)
+    print('listening on', server.getsockname(), file=sys.stderr, flush=True)
+    connection, peer = server.accept()
+    server.close()
+    return connection
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listen', metavar='HOST:PORT')
+    parser.add_argument('--unix', metavar='PATH')
+    args = parser.parse_args(argv)
+
+    if args.listen:
+        host, port = args.listen.rsplit(':', 1)
+        connection = accept(socket.AF_INET, (host, int(port)))
+        report = consume(connection.recv)
+        connection.close()
+    elif args.unix:
+        connection = accept(socket.AF_UNIX, args.unix)
+        try:
+            report = consume(connection.recv)
+        finally:
+            connection.close()
+            os.remove(args.unix)
+    else:
+        report = consume(sys.stdin.buffer.read1)
+    print(json.dumps(report, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+
+# usage: python benchmarks/run.py [--objects N --verts N ...] [--save-baseline]
+#
+# Times the exporter's main stages on a synthetic scene, using the bpy
+# stand-in, and compares them to a stored baseline. Exits with status 1 when
+# a stage got slower, or uses more memory, than the baseline allows.
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import standin
+import synthetic
+
+standin.install()
+sys.path.insert(0, standin.ROOT)
+
+from io_scene_cycles import export_cycles, nodes
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def bench_gen_mesh(scene, tmpdir):
+    meshes = { obj.data for obj in scene.objects }
+    ctx = export_cycles.ExportContext()
+    for mesh in meshes:
+        for data in export_cycles.gen_mesh(ctx, mesh):
+            pass
+    return sum(len(mesh.vertices) for mesh in meshes), 'verts'
+
+
+def bench_write_material(scene, tmpdir):
+    materials = { m for obj in scene.objects for m in obj.data.materials }
+    for material in materials:
+        nodes.write_material(material)
+    return sum(len(m.node_tree.nodes) for m in materials), 'nodes'
+
+
+def bench_gen_scene_nodes(scene, tmpdir):
+    ctx = export_cycles.begin_export(os.path.join(tmpdir, 'scene.xml'))
+    try:
+        size = sum(len(data) for data in export_cycles.gen_scene_nodes(ctx, scene))
+    finally:
+        export_cycles.end_export(ctx)
+    return size, 'bytes'
+
+
+def bench_export_scene(scene, tmpdir):
+    filepath = os.path.join(tmpdir, 'scene.xml')
+    export_cycles.export_scene(filepath, scene)
+    return os.path.getsize(filepath), 'bytes'
+
+
+benchmarks = (
+    ('gen_mesh', bench_gen_mesh),
+    ('write_material', bench_write_material),
+    ('gen_scene_nodes', bench_gen_scene_nodes),
+    ('export_scene', bench_export_scene),
+)
+
+
+def measure(func, scene, repeat):
+    ''' best time of `repeat` runs, then the peak memory of one more '''
+    tmpdir = tempfile.mkdtemp()
+    try:
+        best = float('inf')
+        for i in range(repeat):
+            start = time.perf_counter()
+            amount, unit = func(scene, tmpdir)
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        func(scene, tmpdir)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(tmpdir)
+    return { 'seconds': best, 'amount': amount, 'unit': unit,
+             'throughput': amount / best, 'peak_mb': peak / (1 << 20) }
+
+
+def compare(results, baseline, threshold):
+    ''' names of the stages that regressed beyond threshold '''
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('seconds', 'peak_mb'):
+            if result[key] > base[key] * (1 + threshold):
+                regressions.append('%s %s: %.3f, baseline %.3f' % (
+                    name, key, result[key], base[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--objects', type=int, default=10)
+    parser.add_argument('--verts', type=int, default=10000)
+    parser.add_argument('--faces', type=int, default=10000)
+    parser.add_argument('--uv-layers', type=int, default=1)
+    parser.add_argument('--materials', type=int, default=8)
+    parser.add_argument('--nodes', type=int, default=16, help='mix shaders per material')
+    parser.add_argument('--shared', type=float, default=0.0, help='fraction of objects sharing a mesh')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', help='run only this stage')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown over the baseline, 0.25 is 25%%')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    scene = synthetic.scene(args.objects, args.verts, args.faces, args.uv_layers,
+                            args.materials, args.nodes, args.shared)
+    print('%d objects, %d verts, %d faces, %d uv layers, %d materials of %d nodes' % (
+        args.objects, args.verts, args.faces, args.uv_layers, args.materials,
+        len(synthetic.node_material('', args.nodes).node_tree.nodes)))
+
+    results = {}
+    for name, func in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        result = results[name] = measure(func, scene, args.repeat)
+        print('%-16s %9.3f s %14.0f %s/s %9.1f MB peak' % (
+            name, result['seconds'], result['throughput'], result['unit'], result['peak_mb']))
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)
+        print('baseline saved to', args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as fp:
+        regressions = compare(results, json.load(fp), args.threshold)
+    for line in regressions:
+        print('REGRESSION', line)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
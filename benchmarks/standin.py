@@ -0,0 +1,548 @@
+
+# A stand-in for the parts of blender's API the exporter uses, so the
+# benchmarks can run with a plain python interpreter.
+#
+# Mesh data lives in flat arrays, and foreach_get copies them in one go like
+# blender does, so bulk reads cost about what they cost in blender. Reading
+# element by element goes through small view objects instead.
+
+import array
+import copy
+import importlib
+import os
+import sys
+import types
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def import_module(name):
+    ''' import io_scene_cycles.<name> without running the package __init__,
+        which needs blender '''
+    package = types.ModuleType('io_scene_cycles')
+    package.__path__ = [os.path.join(ROOT, 'io_scene_cycles')]
+    sys.modules.setdefault('io_scene_cycles', package)
+    return importlib.import_module('io_scene_cycles.' + name)
+
+
+# mathutils
+
+class Vector(tuple):
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+    def __new__(cls, values=(0.0, 0.0, 0.0)):
+        return tuple.__new__(cls, values)
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self, other))
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self, other))
+
+    def dot(self, other):
+        return sum(a * b for a, b in zip(self, other))
+
+    @property
+    def length(self):
+        return self.dot(self) ** 0.5
+
+
+class Matrix(list):
+
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = [[float(i == j) for j in range(4)] for i in range(4)]
+        list.__init__(self, [Vector(row) for row in rows])
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix([[sum(self[i][k] * other[k][j] for k in range(4))
+                            for j in range(4)] for i in range(4)])
+        v = tuple(other) + (1.0,) * (4 - len(other))
+        return Vector(sum(self[i][k] * v[k] for k in range(4)) for i in range(3))
+
+    def transposed(self):
+        return Matrix([[self[j][i] for j in range(4)] for i in range(4)])
+
+    def inverted(self):
+        # only rigid transforms are generated: transpose the rotation
+        rotation = [[self[j][i] for j in range(3)] for i in range(3)]
+        t = [-sum(rotation[i][k] * self[k][3] for k in range(3)) for i in range(3)]
+        return Matrix([rotation[i] + [t[i]] for i in range(3)] + [[0.0, 0.0, 0.0, 1.0]])
+
+    @property
+    def translation(self):
+        return Vector(self[i][3] for i in range(3))
+
+    @staticmethod
+    def Scale(factor, size, axis):
+        m = Matrix()
+        for i in range(3):
+            if axis[i]:
+                m[i] = Vector(factor if j == i else 0.0 for j in range(4))
+        return m
+
+    @staticmethod
+    def Translation(v):
+        m = Matrix()
+        for i in range(3):
+            m[i] = Vector(list(m[i][:3]) + [float(v[i])])
+        return m
+
+
+# bpy_prop_collection
+
+class Element:
+    ''' one item of a Collection, its attributes read from the arrays '''
+
+    def __init__(self, collection, index):
+        self._collection = collection
+        self._index = index
+
+    def __getattr__(self, name):
+        attrs = self._collection._attrs
+        if name not in attrs:
+            raise AttributeError(name)
+        values, width = attrs[name]
+        i = self._index
+        if width == 1:
+            return values[i]
+        return Vector(values[i*width:(i+1)*width])
+
+    def as_pointer(self):
+        return id(self._collection) * 1000003 + self._index
+
+
+class Collection:
+
+    def __init__(self, size, **attrs):
+        self._size = size
+        self._attrs = { name: (values, len(values) // size if size else 1)
+                        for name, values in attrs.items() }
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return Element(self, index)
+
+    def __iter__(self):
+        return (Element(self, i) for i in range(self._size))
+
+    def foreach_get(self, attr, seq):
+        seq[:] = self._attrs[attr][0]
+
+    def copy(self):
+        result = copy.copy(self)
+        result._attrs = { name: (values[:], width)
+                          for name, (values, width) in self._attrs.items() }
+        return result
+
+
+class TessFace(Element):
+    @property
+    def vertices(self):
+        raw = self.vertices_raw
+        return raw[:4] if raw[3] else raw[:3]
+
+
+class TessFaceUV(Element):
+    @property
+    def uv(self):
+        ''' 3 pairs for a triangle, as blender gives, 4 for a quad '''
+        raw = self.uv_raw
+        end = 8 if self.vertices_raw[3] else 6
+        return [raw[i:i+2] for i in range(0, end, 2)]
+
+
+class TessFaces(Collection):
+    element = TessFace
+
+    def __getitem__(self, index):
+        item = Collection.__getitem__(self, index)
+        if isinstance(item, list):
+            return [self.element(self, i._index) for i in item]
+        return self.element(self, index)
+
+    def __iter__(self):
+        return (self.element(self, i) for i in range(self._size))
+
+
+class TessFaceUVs(TessFaces):
+    element = TessFaceUV
+
+
+class Layer:
+    def __init__(self, name, data, active_render=True):
+        self.name = name
+        self.data = data
+        self.active_render = active_render
+
+
+# bpy.types
+
+class ID:
+    users = 1
+
+    def __init__(self, name):
+        self.name = name
+
+    def as_pointer(self):
+        return id(self)
+
+
+class Mesh(ID):
+    ''' built from flat arrays: positions, face sizes (3 or 4), face vertex
+        indices and one list of per-corner uvs for every uv layer '''
+
+    def __init__(self, name, positions, sizes, indices, uv_layers=()):
+        ID.__init__(self, name)
+        nverts = len(positions) // 3
+        nfaces = len(sizes)
+        self.materials = []
+        self.shape_keys = None
+        self.animation_data = None
+
+        starts = array.array('i', bytes(4 * nfaces))
+        raw = array.array('i', bytes(16 * nfaces))
+        corner = 0
+        for f, size in enumerate(sizes):
+            starts[f] = corner
+            raw[4*f:4*f+size] = indices[corner:corner+size]
+            corner += size
+
+        self.vertices = Collection(nverts, co=positions,
+                                   normal=array.array('f', [0.0, 0.0, 1.0] * nverts))
+        self.polygons = Collection(nfaces, loop_start=starts, loop_total=sizes)
+        self.loops = Collection(len(indices), vertex_index=indices)
+        self.tessfaces = TessFaces(nfaces, vertices_raw=raw)
+
+        self.uv_layers = []
+        self.uv_textures = []
+        self.tessface_uv_textures = []
+        for n, uv in enumerate(uv_layers):
+            name = 'UVMap.%03d' % n
+            uvraw = array.array('f', bytes(32 * nfaces))
+            for f in range(nfaces):
+                start = 2 * starts[f]
+                uvraw[8*f:8*f+2*sizes[f]] = uv[start:start+2*sizes[f]]
+            self.uv_layers.append(Layer(name, Collection(len(indices), uv=uv), n == 0))
+            self.uv_textures.append(Layer(name, None, n == 0))
+            # tessface uvs know their face's size, as in blender
+            tessface_uvs = TessFaceUVs(nfaces, uv_raw=uvraw, vertices_raw=raw)
+            self.tessface_uv_textures.append(Layer(name, tessface_uvs, n == 0))
+
+    def copy(self):
+        ''' a copy with its own arrays, as evaluating an object makes '''
+        result = copy.copy(self)
+        result.users = 0
+        for name in ('vertices', 'polygons', 'loops', 'tessfaces'):
+            setattr(result, name, getattr(self, name).copy())
+        for name in ('uv_layers', 'tessface_uv_textures'):
+            setattr(result, name, [Layer(layer.name, layer.data.copy(), layer.active_render)
+                                   for layer in getattr(self, name)])
+        return result
+
+    def decimated(self, ratio):
+        ''' a copy keeping its first faces and the vertices they use, as
+            many faces as blender's collapse leaves triangles; it doesn't
+            cost what the collapse does '''
+        sizes = self.polygons._attrs['loop_total'][0]
+        nfaces = min(len(sizes), int(ratio * (len(self.loops) - 2*len(sizes))))
+        corners = sum(sizes[:nfaces])
+        indices = self.loops._attrs['vertex_index'][0][:corners]
+        nverts = max(indices) + 1 if indices else 0
+        result = Mesh(self.name, self.vertices._attrs['co'][0][:3*nverts], sizes[:nfaces],
+                      indices, [layer.data._attrs['uv'][0][:2*corners] for layer in self.uv_layers])
+        result.materials = self.materials
+        return result
+
+
+class Spline:
+    ''' a POLY or NURBS spline from x y z w points, or a BEZIER one from
+        points and handles '''
+
+    def __init__(self, type, co, radius, handle_left=None, handle_right=None, cyclic=False):
+        self.type = type
+        self.use_cyclic_u = cyclic
+        n = len(radius)
+        if type == 'BEZIER':
+            self.bezier_points = Collection(n, co=co, radius=radius, handle_left=handle_left,
+                                            handle_right=handle_right)
+            self.points = Collection(0)
+        else:
+            self.points = Collection(n, co=co, radius=radius)
+            self.bezier_points = Collection(0)
+
+
+class Curve(ID):
+    bevel_object = None
+    extrude = 0.0
+    resolution_u = 12
+
+    def __init__(self, name, splines, bevel_depth=0.0):
+        ID.__init__(self, name)
+        self.splines = splines
+        self.bevel_depth = bevel_depth
+        self.materials = []
+
+
+class Particle:
+    def __init__(self, keys):
+        self.hair_keys = Collection(len(keys) // 3, co=keys)
+
+
+class ParticleSystem:
+    def __init__(self, name, particles, root_width=1.0, tip_width=0.0, radius_scale=0.01):
+        self.name = name
+        self.particles = particles
+        self.settings = types.SimpleNamespace(type='HAIR', render_type='PATH',
+            use_render_emitter=True, cycles=types.SimpleNamespace(
+                root_width=root_width, tip_width=tip_width, radius_scale=radius_scale))
+
+
+class DupliObject:
+    def __init__(self, object, matrix):
+        self.object = object
+        self.matrix = matrix
+        self.hide = False
+
+
+class DupliList(list):
+    def foreach_get(self, attr, seq):
+        if attr == 'hide':
+            seq[:] = array.array('i', (dupli.hide for dupli in self))
+            return
+        # matrices are stored column by column
+        seq[:] = array.array('f', (dupli.matrix[r][c] for dupli in self
+                                   for c in range(4) for r in range(4)))
+
+
+class Socket:
+    def __init__(self, name, type, default=None, identifier=None):
+        self.name = name
+        self.type = type
+        self.identifier = identifier or name
+        if default is not None:
+            self.default_value = default
+
+    def as_pointer(self):
+        return id(self)
+
+
+class Sockets(list):
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for socket in self:
+                if socket.name == key:
+                    return socket
+            raise KeyError(key)
+        return list.__getitem__(self, key)
+
+
+class Node:
+    def __init__(self, name, type, inputs=(), outputs=()):
+        self.name = name
+        self.type = type
+        self.inputs = Sockets(inputs)
+        self.outputs = Sockets(outputs)
+
+
+class Link:
+    def __init__(self, from_node, from_socket, to_node, to_socket):
+        self.from_node = from_node
+        self.from_socket = from_socket
+        self.to_node = to_node
+        self.to_socket = to_socket
+
+
+class NodeTree(ID):
+    def __init__(self, nodes, links):
+        ID.__init__(self, 'NodeTree')
+        self.nodes = nodes
+        self.links = links
+
+
+class Material(ID):
+    def __init__(self, name, node_tree):
+        ID.__init__(self, name)
+        self.use_nodes = True
+        self.node_tree = node_tree
+
+
+class Modifier:
+    def __init__(self, name, type, show_viewport=True):
+        self.name = name
+        self.type = type
+        self.show_viewport = show_viewport
+        self.show_render = show_viewport
+        self.bl_rna = types.SimpleNamespace(properties=[])
+
+
+class Modifiers(list):
+    def new(self, name, type):
+        modifier = Modifier(name, type)
+        self.append(modifier)
+        return modifier
+
+
+class Camera(ID):
+    type = 'PERSP'
+    clip_start = 0.1
+    clip_end = 1000.0
+    angle = 0.8575560450553894
+    ortho_scale = 7.314
+    sensor_width = 32.0
+    sensor_height = 18.0
+    sensor_fit = 'AUTO'
+    shift_x = 0.0
+    shift_y = 0.0
+
+
+class Object(ID):
+
+    def __init__(self, name, type, data, matrix_world=None):
+        ID.__init__(self, name)
+        self.type = type
+        self.data = data
+        self.matrix_world = matrix_world or Matrix()
+        self.layers = [True] + [False] * 19
+        self.hide_render = False
+        self.dupli_type = 'NONE'
+        self.dupli_group = None
+        self.modifiers = Modifiers()
+        self.particle_systems = []
+        self.parent = None
+        self.duplis = [] # (object, matrix) of every instance obj makes
+        self.dupli_list = None
+        self.location = self.matrix_world.translation
+        self.deforming = False
+
+    @property
+    def bound_box(self):
+        co = self.data.vertices._attrs['co'][0]
+        lo = [min(co[i::3]) for i in range(3)]
+        hi = [max(co[i::3]) for i in range(3)]
+        return [Vector((hi[0] if c & 4 else lo[0], hi[1] if c & 2 else lo[1],
+                        hi[2] if c & 1 else lo[2])) for c in range(8)]
+
+    def to_mesh(self, scene, apply_modifiers, settings, *args, **kwargs):
+        mesh = self.data.copy()
+        for modifier in self.modifiers:
+            if modifier.type == 'DECIMATE' and apply_modifiers:
+                mesh = mesh.decimated(modifier.ratio)
+        data.meshes.append(mesh)
+        return mesh
+
+    def is_deform_modified(self, scene, settings):
+        return self.deforming
+
+    def dupli_list_create(self, scene, settings='VIEWPORT'):
+        self.dupli_list = DupliList(DupliObject(obj, matrix) for obj, matrix in self.duplis)
+
+    def dupli_list_clear(self):
+        self.dupli_list = None
+
+
+class Render:
+    resolution_percentage = 100
+    resolution_x = 1920
+    resolution_y = 1080
+    pixel_aspect_x = 1.0
+    pixel_aspect_y = 1.0
+
+
+class Scene(ID):
+
+    def __init__(self, name, objects, camera, world):
+        ID.__init__(self, name)
+        self.objects = objects
+        self.camera = camera
+        self.world = world
+        self.layers = [True] + [False] * 19
+        self.render = Render()
+        self.frame_start = 1
+        self.frame_end = 1
+        self.frame_current = 1
+        self.animation = {}  # object -> function of the frame returning its matrix
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+        for obj, matrix_at in self.animation.items():
+            obj.matrix_world = matrix_at(frame)
+
+
+class Images(list):
+    def new(self, name, width, height, alpha=True):
+        raise NotImplementedError('images are not part of the stand-in')
+
+    def remove(self, image):
+        list.remove(self, image)
+
+
+class Meshes(list):
+    def remove(self, mesh, *args, **kwargs):
+        for i, item in enumerate(self):
+            if item is mesh:
+                del self[i]
+                return
+
+
+class Objects(list):
+    def new(self, name, object_data):
+        obj = Object(name, 'MESH', object_data)
+        self.append(obj)
+        return obj
+
+    def remove(self, obj, *args, **kwargs):
+        list.remove(self, obj)
+
+
+data = types.SimpleNamespace(images=Images(), meshes=Meshes(), objects=Objects())
+
+
+def install():
+    ''' registers the stand-in as bpy, bpy_extras and mathutils '''
+    if 'bpy' in sys.modules:
+        return sys.modules['bpy']
+
+    bpy = types.ModuleType('bpy')
+    bpy_types = types.ModuleType('bpy.types')
+    for name in ('Operator', 'PropertyGroup', 'Panel'):
+        setattr(bpy_types, name, type(name, (), {}))
+    for cls in (ID, Mesh, Curve, Material, NodeTree, Object, Scene, Camera):
+        setattr(bpy_types, cls.__name__, cls)
+    bpy_props = types.ModuleType('bpy.props')
+    bpy_props.BoolProperty = bpy_props.EnumProperty = bpy_props.IntProperty = \
+        bpy_props.PointerProperty = bpy_props.StringProperty = lambda **kwargs: None
+    bpy.types = bpy_types
+    bpy.props = bpy_props
+    bpy.data = data
+    # the benchmarks run as blender -b runs a script
+    bpy.app = types.SimpleNamespace(background=True)
+    bpy.path = types.SimpleNamespace(abspath=lambda path, library=None: path,
+                                     ensure_ext=lambda path, ext: path if path.endswith(ext) else path + ext)
+
+    bpy_extras = types.ModuleType('bpy_extras')
+    io_utils = types.ModuleType('bpy_extras.io_utils')
+    io_utils.ExportHelper = type('ExportHelper', (), {})
+    bpy_extras.io_utils = io_utils
+
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Matrix = Matrix
+    mathutils.Vector = Vector
+
+    sys.modules.update({
+        'bpy': bpy, 'bpy.types': bpy_types, 'bpy.props': bpy_props,
+        'bpy_extras': bpy_extras, 'bpy_extras.io_utils': io_utils,
+        'mathutils': mathutils,
+    })
+    return bpy
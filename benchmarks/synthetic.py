@@ -0,0 +1,171 @@
+
+# Synthetic scenes for the benchmarks, built on the stand-in in standin.py.
+
+import array
+import math
+import random
+import struct
+import types
+
+import standin
+
+
+def float32(x):
+    return struct.unpack('f', struct.pack('f', x))[0]
+
+
+def grid_mesh(name, nverts, nfaces, uv_layers=1, seed=0):
+    ''' a bumpy grid of nverts vertices, with up to nfaces faces alternating
+        between quads and pairs of triangles '''
+    rnd = random.Random(seed)
+    nx = max(2, int(math.ceil(math.sqrt(nverts))))
+    positions = array.array('f', bytes(12 * nverts))
+    for i in range(nverts):
+        positions[3*i:3*i+3] = array.array('f', (
+            i % nx + rnd.random(), i // nx + rnd.random(), rnd.uniform(-1, 1)))
+
+    sizes = array.array('i')
+    indices = array.array('i')
+    cell = 0
+    while len(sizes) < nfaces:
+        a = (cell // (nx-1)) * nx + cell % (nx-1)
+        b, c, d = a + 1, a + nx + 1, a + nx
+        if c >= nverts:
+            break
+        if cell % 2:
+            sizes.extend((3, 3))
+            indices.extend((a, b, c, a, c, d))
+        else:
+            sizes.append(4)
+            indices.extend((a, b, c, d))
+        cell += 1
+    del sizes[nfaces:]
+    del indices[sum(sizes):]
+
+    uvs = []
+    for layer in range(uv_layers):
+        uv = array.array('f', bytes(8 * len(indices)))
+        for corner, v in enumerate(indices):
+            uv[2*corner] = positions[3*v] / nx
+            uv[2*corner+1] = positions[3*v+1] / nx + layer
+        uvs.append(uv)
+    return standin.Mesh(name, positions, sizes, indices, uvs)
+
+
+def cable(name, splines, points, bezier=False, seed=0):
+    ''' a beveled curve of random walks, as poly or bezier splines '''
+    rnd = random.Random(seed)
+    result = []
+    for i in range(splines):
+        co = []
+        x, y, z = rnd.uniform(-10, 10), rnd.uniform(-10, 10), 0.0
+        for j in range(points):
+            x, y, z = x + rnd.uniform(-1, 1), y + rnd.uniform(-1, 1), z + rnd.uniform(0, 1)
+            co.append((x, y, z))
+        radius = array.array('f', (rnd.uniform(0.5, 1.5) for j in range(points)))
+        if bezier:
+            flat = array.array('f', (c for p in co for c in p))
+            left = array.array('f', (c - 0.3 for c in flat))
+            right = array.array('f', (c + 0.3 for c in flat))
+            result.append(standin.Spline('BEZIER', flat, radius, left, right))
+        else:
+            flat = array.array('f', (c for p in co for c in p + (1.0,)))
+            result.append(standin.Spline('POLY', flat, radius))
+    return standin.Curve(name, result, bevel_depth=0.05)
+
+
+def hair(name, particles, keys, seed=0):
+    ''' a particle system of straight, randomly leaning hairs '''
+    rnd = random.Random(seed)
+    result = []
+    for i in range(particles):
+        x, y = rnd.uniform(-1, 1), rnd.uniform(-1, 1)
+        dx, dy = rnd.uniform(-0.1, 0.1), rnd.uniform(-0.1, 0.1)
+        result.append(standin.Particle(array.array('f', (
+            c for k in range(keys) for c in (x + k*dx, y + k*dy, 0.1*k)))))
+    return standin.ParticleSystem(name, result)
+
+
+def scatter(name, source, count, mode='VERTS', seed=0):
+    ''' an object instancing source count times, on its vertices (VERTS) or
+        from a particle system (PARTICLES) '''
+    rnd = random.Random(seed)
+    emitter = standin.Object(name, 'MESH', grid_mesh(name, 16, 9, seed=seed))
+    if mode == 'PARTICLES':
+        settings = types.SimpleNamespace(type='EMITTER', render_type='OBJECT',
+                                         use_render_emitter=True)
+        emitter.particle_systems.append(types.SimpleNamespace(name=name, settings=settings))
+    else:
+        emitter.dupli_type = mode
+        source.parent = emitter
+    for i in range(count):
+        matrix = standin.Matrix.Translation((rnd.uniform(-50, 50), rnd.uniform(-50, 50), 0.0))
+        scale = rnd.uniform(0.5, 1.5)
+        for r in range(3):
+            matrix[r] = standin.Vector([c * scale if j < 3 else c for j, c in enumerate(matrix[r])])
+        emitter.duplis.append((source, matrix))
+    return emitter
+
+
+def diffuse(i, rnd):
+    return standin.Node('Diffuse BSDF.%03d' % i, 'BSDF_DIFFUSE',
+        [standin.Socket('Color', 'RGBA', (rnd.random(), rnd.random(), rnd.random(), 1.0)),
+         standin.Socket('Roughness', 'VALUE', rnd.random()),
+         standin.Socket('Normal', 'VECTOR', (0.0, 0.0, 0.0))],
+        [standin.Socket('BSDF', 'SHADER')])
+
+
+def mix(i):
+    return standin.Node('Mix Shader.%03d' % i, 'MIX_SHADER',
+        [standin.Socket('Fac', 'VALUE', 0.5),
+         standin.Socket('Shader', 'SHADER'),
+         standin.Socket('Shader', 'SHADER', identifier='Shader_001')],
+        [standin.Socket('Shader', 'SHADER')])
+
+
+def node_material(name, size, seed=0):
+    ''' a chain of `size` mix shaders, each blending in a new diffuse bsdf '''
+    rnd = random.Random(seed)
+    output = standin.Node('Material Output', 'OUTPUT_MATERIAL',
+        [standin.Socket('Surface', 'SHADER'), standin.Socket('Volume', 'SHADER')])
+    nodes = [output]
+    links = []
+    prev = diffuse(0, rnd)
+    nodes.append(prev)
+    for i in range(1, size+1):
+        bsdf = diffuse(i, rnd)
+        blend = mix(i)
+        nodes += [bsdf, blend]
+        links.append(standin.Link(prev, prev.outputs[0], blend, blend.inputs[1]))
+        links.append(standin.Link(bsdf, bsdf.outputs[0], blend, blend.inputs[2]))
+        prev = blend
+    links.append(standin.Link(prev, prev.outputs[0], output, output.inputs[0]))
+    return standin.Material(name, standin.NodeTree(nodes, links))
+
+
+def scene(objects=10, verts=10000, faces=10000, uv_layers=1, materials=4,
+          nodes=8, shared=0.0, seed=0):
+    ''' objects on a line in front of the camera; the first `shared` fraction
+        of them use the same mesh data '''
+    mats = [node_material('Material.%03d' % i, nodes, seed+i) for i in range(materials)]
+    world = standin.Material('World', standin.NodeTree([], []))
+    nshared = int(objects * shared)
+    shared_mesh = grid_mesh('Shared', verts, faces, uv_layers, seed) if nshared else None
+    if shared_mesh is not None:
+        shared_mesh.users = nshared
+        shared_mesh.materials = mats[:1]
+
+    objs = []
+    for i in range(objects):
+        if i < nshared:
+            mesh = shared_mesh
+        else:
+            mesh = grid_mesh('Mesh.%03d' % i, verts, faces, uv_layers, seed+i)
+            if mats:
+                mesh.materials = [mats[i % len(mats)]]
+        matrix = standin.Matrix.Translation((3.0 * i, 0.0, 0.0))
+        objs.append(standin.Object('Object.%03d' % i, 'MESH', mesh, matrix))
+
+    camera = standin.Object('Camera', 'CAMERA', standin.Camera('Camera'),
+                            standin.Matrix.Translation((0.0, 0.0, 50.0)))
+    return standin.Scene('Scene', objs, camera, world)
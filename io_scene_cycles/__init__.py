@@ -18,7 +18,7 @@
 
 import bpy
 from bpy_extras.io_utils import ExportHelper
-from bpy.props import PointerProperty, StringProperty
+from bpy.props import BoolProperty, EnumProperty, IntProperty, PointerProperty, StringProperty
 
 
 class CyclesXMLSettings(bpy.types.PropertyGroup):
@@ -71,19 +71,89 @@ class ExportCyclesXML(bpy.types.Operator, ExportHelper):
 
     filename_ext = ".xml"
 
+    use_background = BoolProperty(
+            name="Background",
+            description="Keep working while the scene exports, Esc cancels",
+            default=True)
+
+    quality = EnumProperty(
+            name="Quality",
+            description="Settings the scene is evaluated with",
+            items=(('PREVIEW', "Preview", "Viewport levels of modifiers and particles, fast"),
+                   ('RENDER', "Final", "Render levels of modifiers and particles")),
+            default='PREVIEW')
+
+    face_budget = IntProperty(
+            name="Face Budget",
+            description="Decimate every mesh to at most this many faces, 0 keeps them whole",
+            min=0,
+            default=0)
+
+    # seconds of every timer tick spent evaluating the scene, the rest is
+    # left to the interface
+    slice_seconds = 0.05
+    tick_seconds = 0.1
+
+    # one export at a time, the window manager has a single progress bar
+    _running = None
+
     @classmethod
     def poll(cls, context):
         return (context.active_object is not None)
 
     def execute(self, context):
-        filepath = bpy.path.ensure_ext(self.filepath, ".xml")
+        filepath = bpy.path.ensure_ext(self.filepath, self.filename_ext)
 
         from . import export_cycles
 
-        export_cycles.export_scene(self.filepath, context.scene)
-
+        if ExportCyclesXML._running is not None:
+            self.report({'ERROR'}, "A Cycles XML export is already running")
+            return {'CANCELLED'}
+
+        options = { 'preview': self.quality == 'PREVIEW',
+                    'face_budget': self.face_budget or None }
+
+        if not self.use_background or bpy.app.background:
+            export_cycles.export_scene(filepath, context.scene, **options)
+            return {'FINISHED'}
+
+        ExportCyclesXML._running = export_cycles.BackgroundExport(filepath, context.scene,
+                                                                  **options)
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(self.tick_seconds, context.window)
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        export = ExportCyclesXML._running
+        if event.type == 'ESC':
+            self.stop(context)
+            export.cancel()
+            self.report({'WARNING'}, "Cycles XML export cancelled")
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        try:
+            if export.step(self.slice_seconds) or export.writing():
+                context.window_manager.progress_update(100 * export.progress)
+                return {'PASS_THROUGH'}
+        except BaseException:
+            self.stop(context)
+            export.cancel()
+            raise
+        self.stop(context)
+        export.finish()
+        self.report({'INFO'}, "Exported %s" % export.filepath)
         return {'FINISHED'}
 
+    def stop(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        ExportCyclesXML._running = None
+
 
 def menu_func_export(self, context):
     self.layout.operator(ExportCyclesXML.bl_idname, text="Cycles Standalone Renderer XML (.xml)")
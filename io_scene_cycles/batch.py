@@ -0,0 +1,252 @@
+
+# Exports many .blend files, scenes and frame ranges from a pool of
+# background blender processes.
+#
+# usage: python io_scene_cycles/batch.py [options] JOB [JOB ...]
+#
+# where every JOB is FILE.blend[:SCENE[:START-END]], e.g.
+#
+#   python io_scene_cycles/batch.py -o out -j 8 --retries 2 \
+#       shots/*.blend sh010.blend:Layout:1-120 --option output=compact
+#
+# Every job runs `blender -b FILE.blend -P batch.py -- --worker ...`, which
+# exports SCENE (the file's active one by default) to OUTPUT/NAME[_SCENE].xml,
+# or frames START-END to OUTPUT/NAME[_SCENE]_START-END_0001.xml ... with
+# export_animation(). Jobs writing to the same name are refused.
+# Failed jobs are run again up to --retries times. A summary of every job's
+# timings and output sizes is printed, and written to --summary as json.
+# Blender's output of every attempt goes to OUTPUT/NAME[_SCENE][_START-END].log.
+#
+# With --plan, nothing is exported: every job is a dry run (see plan.py)
+# projecting its output size and export time, with the --profile calibrated
+# by plan.calibrate() when given, and the objects over --flag-seconds are
+# listed, for a scheduler to pack the real jobs by.
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+
+def parse_job(spec, scene=None, frames=None):
+    ''' FILE.blend[:SCENE[:START-END]] to a job; scene and frames are the
+        defaults for what spec leaves out '''
+    # drive letters have a colon too
+    head, sep, tail = spec.partition('.blend:')
+    blend = head + '.blend' if sep else spec
+    parts = tail.split(':') if sep else []
+    if parts:
+        scene = parts[0] or scene
+    if len(parts) > 1:
+        frames = parts[1] or frames
+    if isinstance(frames, str):
+        start, sep, end = frames.partition('-')
+        frames = (int(start), int(end or start))
+    return { 'blend': os.path.abspath(blend), 'scene': scene, 'frames': frames }
+
+
+def parse_option(text):
+    ''' key=value, value read as json, as a string otherwise '''
+    key, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected key=value, got %r' % text)
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def job_name(job):
+    name = os.path.splitext(os.path.basename(job['blend']))[0]
+    if job['scene']:
+        name += '_' + job['scene']
+    if job['frames']:
+        name += '_%04d-%04d' % tuple(job['frames'])
+    return name
+
+
+def run_job(job, args, report_path):
+    ''' one attempt at job in a blender process, its report or None '''
+    name = job_name(job)
+    command = [args.blender, '-b', job['blend'], '-P', os.path.abspath(__file__), '--',
+               '--worker', json.dumps(job), '--output', os.path.join(args.output, name + '.xml'),
+               '--report', report_path, '--options', json.dumps(args.options)]
+    if args.plan:
+        command += ['--plan', '--flag-seconds', str(args.flag_seconds)]
+        if args.profile:
+            command += ['--profile', args.profile]
+    with open(os.path.join(args.output, name + '.log'), 'a') as log:
+        log.write('$ %s\n' % subprocess.list2cmdline(command))
+        log.flush()
+        try:
+            status = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT,
+                                     stdin=subprocess.DEVNULL, timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            log.write('timed out after %ss\n' % args.timeout)
+            return None
+    # blender exits with 0 after a failing script, only the report tells
+    if status != 0 or not os.path.exists(report_path):
+        return None
+    with open(report_path) as fp:
+        return json.load(fp)
+
+
+def schedule(job, args):
+    ''' runs job until it succeeds, at most 1 + args.retries times '''
+    result = { 'job': job, 'name': job_name(job), 'attempts': 0, 'ok': False }
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        while result['attempts'] <= args.retries and not result['ok']:
+            result['attempts'] += 1
+            report = run_job(job, args, os.path.join(tmpdir, 'report%d.json' % result['attempts']))
+            if report is not None:
+                result.update(report, ok=True)
+    result['seconds'] = time.perf_counter() - start
+    print('%-40s %s after %d attempt(s), %.1fs' % (
+        result['name'], 'done' if result['ok'] else 'FAILED', result['attempts'],
+        result['seconds']), flush=True)
+    return result
+
+
+def print_summary(results):
+    print()
+    print('%-40s %6s %9s %9s %11s' % ('job', 'status', 'attempts', 'seconds', 'MB'))
+    for r in results:
+        print('%-40s %6s %9d %9.1f %11.2f' % (
+            r['name'], 'ok' if r['ok'] else 'FAILED', r['attempts'],
+            r.get('projected_seconds', r['seconds']), r.get('bytes', 0) / (1 << 20)))
+        for name in r.get('flagged', ()):
+            print('    flagged: %s' % name)
+    failed = sum(not r['ok'] for r in results)
+    print('%d jobs, %d failed, %.2f MB %s' % (
+        len(results), failed, sum(r.get('bytes', 0) for r in results) / (1 << 20),
+        'projected' if any('projected_seconds' in r for r in results) else 'written'))
+
+
+def output_size(paths):
+    ''' bytes of the files and directories in paths that exist '''
+    size = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        elif os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+def worker(argv):
+    ''' runs inside blender: exports the job in argv, writes its report '''
+    parser = argparse.ArgumentParser(prog='batch.py -- --worker')
+    parser.add_argument('--worker', type=json.loads)
+    parser.add_argument('--output')
+    parser.add_argument('--report')
+    parser.add_argument('--options', type=json.loads, default={})
+    parser.add_argument('--plan', action='store_true')
+    parser.add_argument('--profile')
+    parser.add_argument('--flag-seconds', type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    import bpy
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from io_scene_cycles import export_cycles, plan, util
+
+    job = args.worker
+    scene = bpy.data.scenes[job['scene']] if job['scene'] else bpy.context.scene
+
+    if args.plan:
+        report = plan.plan_scene(scene, args.profile, args.flag_seconds, **args.options)
+        # every frame written whole, an upper bound for animations
+        frames = job['frames'][1] - job['frames'][0] + 1 if job['frames'] else 1
+        util.write_file(args.report, json.dumps({
+            'projected_seconds' : frames * report['total']['seconds'],
+            'bytes'             : frames * report['total']['bytes'],
+            'flagged'           : report['flagged'],
+            'report'            : report,
+        }))
+        return
+    ext = util.compression_ext(args.output)
+    base, xmlext = os.path.splitext(args.output[:len(args.output)-len(ext)])
+
+    start = time.perf_counter()
+    if job['frames']:
+        frame_start, frame_end = job['frames']
+        report = export_cycles.export_animation(args.output, scene, frame_start, frame_end,
+                                                **args.options)
+        paths = [base + '_shared' + xmlext + ext] + [
+            base + '_%04d' % frame + xmlext + ext for frame in range(frame_start, frame_end+1)]
+    else:
+        report = export_cycles.export_scene(args.output, scene, **args.options)
+        paths = [args.output]
+    seconds = time.perf_counter() - start
+
+    util.write_file(args.report, json.dumps({
+        'export_seconds' : seconds,
+        'files'          : paths,
+        'bytes'          : output_size(paths + [base + '_meshes']),
+        'report'         : report,
+    }, default=str))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Exports .blend files to cycles xml from a pool of background blenders')
+    parser.add_argument('jobs', nargs='+', metavar='FILE.blend[:SCENE[:START-END]]')
+    parser.add_argument('-o', '--output', default='.', help='directory to export to')
+    parser.add_argument('-j', '--jobs', dest='concurrency', type=int,
+                        default=os.cpu_count() or 1, help='blender processes at once')
+    parser.add_argument('--retries', type=int, default=1)
+    parser.add_argument('--timeout', type=float, help='seconds before a job is killed')
+    parser.add_argument('--blender', default=os.environ.get('BLENDER', 'blender'))
+    parser.add_argument('--scene', help='scene of jobs that do not name one')
+    parser.add_argument('--frames', metavar='START-END',
+                        help='frame range of jobs that do not give one')
+    parser.add_argument('--option', type=parse_option, action='append', default=[],
+                        help="export option, e.g. output=compact or workers=4")
+    parser.add_argument('--summary', help='also write the summary to this json file')
+    parser.add_argument('--plan', action='store_true',
+                        help='only project the size and time of every job')
+    parser.add_argument('--profile', help='profile saved by plan.calibrate() for --plan')
+    parser.add_argument('--flag-seconds', type=float, default=60.0,
+                        help='objects --plan projects to take longer are listed')
+    args = parser.parse_args(argv)
+    args.options = dict(args.option)
+    args.output = os.path.abspath(args.output)
+    if args.profile:
+        args.profile = os.path.abspath(args.profile)
+    os.makedirs(args.output, exist_ok=True)
+
+    jobs = [parse_job(spec, args.scene, args.frames) for spec in args.jobs]
+    # jobs of the same name would write over each other's files
+    blends = {}
+    for job in jobs:
+        blends.setdefault(job_name(job), []).append(job['blend'])
+    clashes = ['%s (%s)' % (name, ', '.join(paths)) for name, paths in sorted(blends.items())
+               if len(paths) > 1]
+    if clashes:
+        parser.error('jobs would write to the same output: ' + '; '.join(clashes))
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(lambda job: schedule(job, args), jobs))
+
+    print_summary(results)
+    if args.summary:
+        with open(args.summary, 'w') as fp:
+            json.dump(results, fp, indent=1, sort_keys=True, default=str)
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    if '--' in sys.argv:
+        # blender -b FILE.blend -P batch.py -- --worker ...
+        try:
+            worker(sys.argv[sys.argv.index('--')+1:])
+        except Exception:
+            traceback.print_exc()
+            sys.exit(1)
+    else:
+        sys.exit(main())
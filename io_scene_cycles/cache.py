@@ -0,0 +1,86 @@
+
+# On-disk cache of serialized objects, for incremental re-exports.
+#
+# Every cacheable object gets a fingerprint of everything its output depends
+# on. The fragment written for it is stored under that fingerprint, so an
+# unchanged object is read back instead of being evaluated and serialized
+# again. A manifest next to the exported file records the fingerprints of the
+# last export, to tell which objects changed since.
+
+import json
+import os
+import time
+
+from . import util
+
+
+class FragmentCache:
+
+    def __init__(self, dirpath, manifest_path):
+        self.dirpath = dirpath
+        self.manifest_path = manifest_path
+        self.previous = {}
+        self.current = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fp:
+                self.previous = json.load(fp).get('objects', {})
+
+    def path(self, fingerprint):
+        return os.path.join(self.dirpath, fingerprint + '.xml')
+
+    def get(self, name, fingerprint):
+        ''' the cached fragment of object `name`, None on a miss '''
+        self.current[name] = fingerprint
+        filepath = self.path(fingerprint)
+        try:
+            with open(filepath) as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(filepath)  # recently used, evicted last
+        self.hits += 1
+        return data
+
+    def put(self, fingerprint, data):
+        os.makedirs(self.dirpath, exist_ok=True)
+        util.write_file(self.path(fingerprint), data)
+
+    def evict(self, max_bytes=None, max_age=None):
+        ''' drop fragments unused for max_age seconds, then the least
+            recently used ones until the cache fits in max_bytes '''
+        if not os.path.isdir(self.dirpath):
+            return 0
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.dirpath):
+            filepath = os.path.join(self.dirpath, name)
+            st = os.stat(filepath)
+            entries.append((st.st_mtime, st.st_size, filepath))
+        entries.sort()
+
+        evicted = 0
+        total = sum(e[1] for e in entries)
+        for mtime, size, filepath in entries:
+            if ((max_age is not None and now - mtime > max_age) or
+                (max_bytes is not None and total > max_bytes)):
+                os.remove(filepath)
+                total -= size
+                evicted += 1
+        return evicted
+
+    def close(self, max_bytes=None, max_age=None):
+        ''' writes the manifest, trims the cache and returns a report '''
+        report = {
+            'hits'    : self.hits,
+            'misses'  : self.misses,
+            'dirty'   : sorted(name for name, fingerprint in self.current.items()
+                               if self.previous.get(name) != fingerprint),
+            'removed' : sorted(set(self.previous) - set(self.current)),
+            'evicted' : self.evict(max_bytes, max_age),
+        }
+        util.write_file(self.manifest_path, json.dumps(
+            { 'objects': self.current }, indent=1, sort_keys=True))
+        return report
@@ -1,120 +1,686 @@
 
+import array
+import concurrent.futures
+import hashlib
+import itertools
 import math
+import multiprocessing
 import os
+import queue
+import threading
+import time
 import mathutils
 import bpy.types
 import xml.etree.ElementTree as etree
-import xml.dom.minidom as dom
 
-from . import nodes,util
+from . import cache,nodes,stats,textures,util
 
 write_material = nodes.write_material
 
+# defaults of every export, which ExportContext copies
 _options = {
         'inline_textures' : True,
-        'preview'    : True,
+        'preview'    : True,  # viewport levels of modifiers, instances and deformation,
+                              # False evaluates the scene as it renders
+        'face_budget': None,  # faces of every evaluated mesh, more are decimated
+        'scene_face_budget' : None, # faces of all meshes, shared by the objects in
+                                    # proportion to the faces of their own mesh
         'format_xml' : True,
         'tabsize'    : 2,
         'tabwith'    : ' ',
         'endline'    : '\n',
-        'export_mesh': True,
+        'export_mesh': True, # False writes each mesh to its own include file
+        'include_workers' : 4,
+        'instance_meshes' : True, # shared meshes go to one include, referenced per object
+        'chunk_size' : 1 << 16, # bytes of mesh data formatted and yielded at once
+        'incremental': False, # reuse objects serialized by previous exports
+        'cache_max_bytes' : 4 << 30,
+        'cache_max_age'   : 30*24*3600, # seconds
+        'workers'    : 0, # processes formatting meshes (threads unless the export owns
+                          # the process), 0 formats them in-process
+        'texture_cache'   : textures.DEFAULT_CACHE,
+        'texture_workers' : 4,
+        'stats'      : False, # collect timings, returned and written to <name>.stats.json
+        'profile'    : False, # also profile the export with cProfile, to <name>.prof
+        'memory_budget' : 1 << 30, # bytes of output held in memory at once, roughly
+        'output'     : 'default', # one of _output_profiles
+        'indent'     : True,  # False writes every line unindented
+        'wrap'       : True,  # False writes each array on a single line
+        'precision'  : None,  # significant digits of floats, None writes them exactly
+        'decimals'   : None,  # or rounds floats to this many decimals
+        'mesh_source': 'polygons', # or 'tessfaces', blender's legacy tessellation
+        'triangles'  : False, # split every face into triangles
+        'normals'    : False, # write smooth vertex normals as N
+        'curves'     : False, # write round curves and hair as <curves>, which
+                              # cycles' own xml reader doesn't read
+        'cull'       : False, # skip objects outside the camera's view
+        'cull_margin': 0.1,   # widens the view tested against, 0.1 is 10%
+        'cull_distance' : None, # also skip objects further than this along the view
         }
 
+# sets of options, picked by _options['output'] or per export call
+_output_profiles = {
+        'default' : {},
+        'compact' : { 'format_xml': False, 'indent': False, 'wrap': False, 'decimals': 5 },
+        }
+
+# options that don't change what is written
+_neutral_options = ('include_workers', 'chunk_size', 'incremental',
+                    'cache_max_bytes', 'cache_max_age', 'workers',
+                    'texture_cache', 'texture_workers', 'stats', 'profile',
+                    'memory_budget', 'output')
+
+# translated materials, kept between exports: material name -> (node tree
+# fingerprint, <shader> without its name). Shaders embedding images are not
+# kept, their data is the export's own; end_export() drops the materials the
+# export did not write.
+_shader_memo = {}
+
+
+class ExportContext:
+    ''' the options and the state of one export, handed to everything that
+        writes it, so exports with different options can run at once '''
+
+    def __init__(self, options=None):
+        ''' options override _options, after the output profile
+            options['output'] picks '''
+        options = options or {}
+        for key in options:
+            if key not in _options:
+                raise KeyError('Unknown export option %r' % key)
+        output = options.get('output', _options['output'])
+        if output not in _output_profiles:
+            raise KeyError('Unknown output profile %r' % output)
+        self.options = dict(_options)
+        self.options.update(_output_profiles[output])
+        self.options.update(options)
+        self.NL = self.options['endline']
+        # what blender evaluates the scene with
+        self.settings = 'PREVIEW' if self.options['preview'] else 'RENDER'
+
+        # set up by begin_export() for the duration of an export
+        self.includes = None
+        self.fragments = None
+        self.pool = None
+        self.stats = None
+        self.textures = None # TextureEncoder, when textures are embedded
+        self.mesh_cache = {}
+        self.shader_names = {}  # material -> name of the <shader> it was written as
+        self.shader_bodies = {} # <shader> without its name -> name it was written as
+        self.scene_faces = None # faces of the exported meshes, for scene_face_budget
 
-def _format(node):
-    prefix = _options['tabwith']*_options['tabsize']
+    def format(self, node):
+        if self.options['indent']:
+            return _format(self, node)
+        return _noformat(self, node)
+
+    def format_floats(self, values):
+        ''' str() of every float of values, rounded as the options ask '''
+        values = values.tolist() if hasattr(values, 'tolist') else values
+        if self.options['decimals'] is not None:
+            decimals = self.options['decimals']
+            # adding 0.0 turns the -0.0 of small negatives into 0.0
+            return [str(round(v, decimals) + 0.0) for v in values]
+        if self.options['precision'] is not None:
+            precision = self.options['precision']
+            return ['%.*g' % (precision, v) for v in values]
+        return list(map(str, values))
+
+
+def _format(ctx, node):
+    prefix = ctx.options['tabwith']*ctx.options['tabsize']
+    start = True
     for line in node:
-        yield prefix+line
+        # mesh data comes in chunks of many lines, or of parts of one
+        yield (prefix if start else '') + line[:-1].replace(ctx.NL, ctx.NL+prefix) + line[-1:]
+        start = line.endswith(ctx.NL)
 
 
-def _noformat(node):
+def _noformat(ctx, node):
     yield from node
 
 
-format = _format
-NL = _options['endline']
-
-def gen_xml_include(node, filepath):
+def gen_xml_include(ctx, node, filepath):
     if node :
         include = util.writer(filepath)
         for data in node:
-            writer.send(data)
-        writer.close()
+            include.send(data)
+        include.close()
+
+    yield '<include src="'+filepath+'" />'+ctx.NL
+
+
+def gen_mesh_include(ctx, arrays):
+    owner = ctx.stats and ctx.stats.current
+    if ctx.pool is not None:
+        job = submit_mesh(ctx, arrays, True)
+        include = ctx.includes.pool.submit(write_mesh_include, ctx, job, owner)
+        include.nbytes = job.nbytes
+        yield include
+    else:
+        data = ''.join(gen_cycles(ctx, gen_mesh_data(ctx, arrays)))
+        yield write_mesh_include(ctx, data, owner)
+
+
+def write_mesh_include(ctx, data, owner=None):
+    # the include is resolved relative to the main file by cycles
+    data = util.resolved(data)
+    name = ctx.includes.write(data)
+    if ctx.stats is not None:
+        ctx.stats.count('include_bytes', len(data), owner)
+    src = os.path.basename(ctx.includes.dirpath) + '/' + name
+    return '<include src="'+src+'" />'+ctx.NL
 
-    yield '<include src="'+filepath+'" />'+NL
 
+def gen_cycles(ctx, node):
+    yield '<cycles>'+ctx.NL
+    # meshes formatted by worker processes are waited for here
+    yield from ctx.format(util.ordered(node, 4*ctx.options['workers'],
+                                       ctx.options['memory_budget']))
+    yield '</cycles>'+ctx.NL
 
-def gen_cycles(node):
-    yield '<cycles>'+NL
-    yield from format(node)
-    yield '</cycles>'+NL
 
+def gen_scene_nodes(ctx, scene, progress=None):
+    ''' progress, when given, is called with the number of objects done and
+        the total before each object '''
+    yield from gen_scene_header(ctx, scene)
+    yield from gen_scene_objects(ctx, scene, progress)
 
-def gen_scene_nodes(scene):
-    yield write_film(scene)+NL
+
+def gen_scene_header(ctx, scene, shaders=False):
+    ''' film, camera and background; with shaders, also the shaders of every
+        exported object, which otherwise come with the first object using
+        them '''
+    prefetch_textures(ctx, scene)
+    yield write_film(scene)+ctx.NL
     
-    yield from gen_camera(scene.camera)
-    background = write_material(scene.world, 'background')
+    yield from gen_camera(ctx, scene.camera)
+    yield from gen_background(ctx, scene)
+    if shaders:
+        for obj in scene.objects:
+            if is_exported(obj, scene):
+                for material in object_materials(obj):
+                    if material is not None:
+                        yield from gen_material(ctx, material)
+
+
+def gen_scene_objects(ctx, scene, progress=None):
+    culled = view_culler(ctx, scene)
+    objects = [obj for obj in scene.objects if is_exported(obj, scene)]
+    for done, obj in enumerate(objects):
+        if progress is not None:
+            progress(done, len(objects))
+        if culled is not None and culled(obj):
+            if ctx.stats is not None:
+                ctx.stats.culled.append(obj.name)
+            continue
+        yield from gen_scene_object(ctx, obj, scene)
+
+
+def gen_background(ctx, scene):
+    with timer(ctx, 'materials', scene.world.name, ctx.stats and ctx.stats.materials):
+        background = write_material(scene.world, 'background', ctx.textures)
     if background:
-        yield etree.tostring( background ).decode()+NL
-
-    for obj in scene.objects:
-        if( obj.type not in ['MESH', 'CURVE', 'SURFACE', 'FONT', 'LAMP'] or
-            not any([a and b for a,b in zip(scene.layers, obj.layers)]) or
-            obj.hide_render ):
-               continue
-
-        if obj.dupli_type == 'NONE':
-            print(obj.name)
-            yield from gen_object(obj,scene)
-        elif obj.dupli_type == "GROUP":
-            for grp_obj in obj.dupli_group.objects:
-                yield from gen_object(grp_obj, scene, obj.matrix_world)
+        yield etree.tostring( background ).decode()+ctx.NL
+
+
+def view_culler(ctx, scene):
+    ''' a test telling whether an object lies entirely outside the view of
+        the scene's camera, widened by cull_margin, or further than
+        cull_distance; None when not culling. Objects that make instances,
+        lamps and objects with particles are always kept '''
+    if not ctx.options['cull'] or scene.camera is None:
+        return None
+    camera = scene.camera.data
+    to_camera = scene.camera.matrix_world.inverted()
+    render = scene.render
+    aspect = (render.resolution_x * render.pixel_aspect_x) / (
+              render.resolution_y * render.pixel_aspect_y)
+    fit = camera.sensor_fit
+    if fit == 'AUTO':
+        fit = 'HORIZONTAL' if aspect >= 1 else 'VERTICAL'
+    perspective = camera.type != 'ORTHO'
+    # half the view's size, at a distance of 1 or for any distance
+    half = math.tan(camera.angle / 2) if perspective else camera.ortho_scale / 2
+    if fit == 'HORIZONTAL':
+        half_x, half_y = half, half / aspect
+    else:
+        half_x, half_y = half * aspect, half
+    shift = 2 * max(half_x, half_y)
+    bounds = [(axis, center - size, center + size) for axis, center, size in (
+              (0, camera.shift_x * shift, half_x * (1 + ctx.options['cull_margin'])),
+              (1, camera.shift_y * shift, half_y * (1 + ctx.options['cull_margin'])))]
+    far = camera.clip_end
+    if ctx.options['cull_distance'] is not None:
+        far = min(far, ctx.options['cull_distance'])
+
+    def culled(obj):
+        if (obj.type == 'LAMP' or obj.dupli_type != 'NONE' or
+            getattr(obj, 'particle_systems', None)):
+            return False
+        matrix = to_camera * obj.matrix_world
+        corners = [matrix * mathutils.Vector(corner) for corner in obj.bound_box]
+        # the camera looks down -z
+        depths = [-corner.z for corner in corners]
+        if max(depths) < 0 or min(depths) > far:
+            return True
+        scales = depths if perspective else [1.0] * 8
+        for axis, low, high in bounds:
+            if all(c[axis] < low * w for c, w in zip(corners, scales)):
+                return True
+            if all(c[axis] > high * w for c, w in zip(corners, scales)):
+                return True
+        return False
+    return culled
+
+
+def prefetch_textures(ctx, scene):
+    ''' starts encoding every image the scene's shaders inline, so they are
+        encoded in parallel before the shaders need them '''
+    if ctx.textures is None:
+        return
+    materials = [scene.world] + [m for obj in scene.objects if is_exported(obj, scene)
+                                   for m in object_materials(obj)]
+    for material in materials:
+        if material is None or not material.use_nodes:
+            continue
+        for node in material.node_tree.nodes:
+            if node.type == 'TEX_IMAGE' and node.image is not None:
+                ctx.textures.request(node.image)
+
+
+def is_exported(obj, scene):
+    parent = getattr(obj, 'parent', None)
+    return not( obj.type not in ['MESH', 'CURVE', 'SURFACE', 'FONT', 'LAMP', 'EMPTY'] or
+                not any([a and b for a,b in zip(scene.layers, obj.layers)]) or
+                obj.hide_render or
+                # only rendered as instances on the parent's vertices or faces
+                (parent is not None and parent.dupli_type in ('VERTS', 'FACES')) or
+                (obj.type == 'EMPTY' and obj.dupli_type == 'NONE') )
+
+
+def gen_scene_object(ctx, obj, scene, mesh_key=None):
+    for part, source, name, matrix, key in object_parts(obj, mesh_key):
+        if part == 'duplis':
+            yield from timed_object(ctx, name, gen_duplis(ctx, source, scene))
         else:
-            print("Duplication not supported:",obj.dupli_type,"Object", obj.name,"ignore")
+            yield from timed_object(ctx, name, gen_object(ctx, source, scene, matrix,
+                                                          mesh_key=key, name=name))
+
+
+def object_parts(obj, mesh_key=None):
+    ''' what is written for obj, in order: ('object', object, name, matrix
+        it is placed by, mesh key) for an object, ('duplis', obj, name, None,
+        None) for the instances obj makes. Shared by the export and plan.py '''
+    if obj.dupli_type in ('VERTS', 'FACES'):
+        yield 'duplis', obj, obj.name, None, None
+    elif obj.dupli_type == 'NONE':
+        instancers = particle_instancers(obj)
+        if not instancers or any(p.settings.use_render_emitter for p in instancers):
+            yield 'object', obj, obj.name, None, mesh_key
+        if instancers:
+            yield 'duplis', obj, obj.name, None, None
+    elif obj.dupli_type == "GROUP":
+        for grp_obj in obj.dupli_group.objects:
+            # every instance of a group member evaluates to the same mesh
+            yield 'object', grp_obj, obj.name+'/'+grp_obj.name, obj.matrix_world, ('GROUP', grp_obj)
+    else:
+        print("Duplication not supported:",obj.dupli_type,"Object", obj.name,"ignore")
+
+
+def particle_instancers(obj):
+    return [psys for psys in getattr(obj, 'particle_systems', ())
+                 if psys.settings.render_type in ('OBJECT', 'GROUP')]
+
+
+def gen_duplis(ctx, obj, scene):
+    ''' the instances obj makes on its vertices, faces or particles: the
+        geometry of every instanced object once, to an include file, then
+        a transform around that include for every instance '''
+    obj.dupli_list_create(scene, ctx.settings)
+    try:
+        duplis = obj.dupli_list
+        matrices = util.float_buffer(len(duplis)*16)
+        duplis.foreach_get('matrix', matrices) # column by column, as cycles wants
+        sources = {}
+        for i, dupli in enumerate(duplis):
+            if not dupli.hide:
+                sources.setdefault(dupli.object, []).append(i)
+    finally:
+        obj.dupli_list_clear()
+
+    for source, indices in sources.items():
+        if source.type not in ('MESH','CURVE','FONT','SURFACE'):
             continue
+        shader = None
+        for material in object_materials(source):
+            if material == None : continue
+            yield from gen_material(ctx, material)
+            if shader is None:
+                shader = ctx.shader_names[material]
+
+        include = util.resolved(dupli_include(ctx, source, scene)).strip()
+        if shader is not None : yield '<state shader="'+util.xml_escape(shader)+'" >'+ctx.NL
+        yield from gen_instances(ctx, gather_matrices(matrices, indices), include)
+        if shader is not None : yield '</state>'+ctx.NL
+
+
+def dupli_include(ctx, source, scene):
+    ''' the <include> of the geometry of an instanced object, written once '''
+    key = ('DUPLI', source)
+    if key not in ctx.mesh_cache:
+        if ctx.includes is None:
+            # no include files: the geometry is repeated in every instance
+            if is_curve(ctx, source):
+                node = gen_curves(ctx, curve_arrays(source.data))
+            else:
+                node = gen_mesh_data(ctx, object_mesh(ctx, source, scene))
+            ctx.mesh_cache[key] = [''.join(ctx.format(util.ordered(
+                node, 4*ctx.options['workers'], ctx.options['memory_budget'])))]
+        elif is_curve(ctx, source):
+            data = ''.join(gen_cycles(ctx, gen_curves(ctx, curve_arrays(source.data))))
+            ctx.mesh_cache[key] = [write_mesh_include(ctx, data)]
+        else:
+            ctx.mesh_cache[key] = list(gen_mesh_include(ctx, object_mesh(ctx, source, scene)))
+    return ctx.mesh_cache[key][0]
+
+
+def gather_matrices(matrices, indices):
+    if util.numpy is not None:
+        return matrices.reshape(-1, 16)[indices].ravel()
+    return list(itertools.chain.from_iterable(matrices[16*i:16*i+16] for i in indices))
+
 
+def gen_instances(ctx, matrices, include):
+    ''' a transform around include for every 16 floats of matrices, which
+        are formatted together, in chunks of about chunk_size bytes '''
+    count = len(matrices) // 16
+    if ctx.stats is not None:
+        ctx.stats.count('instances', count)
+    step = max(1, ctx.options['chunk_size'] // 400)
+    for first in range(0, count, step):
+        tokens = ctx.format_floats(matrices[16*first:16*(first+step)])
+        yield ''.join('<transform matrix="'+' '.join(tokens[i:i+16])+'">'+
+                      include+'</transform>'+ctx.NL for i in range(0, len(tokens), 16))
 
-def gen_camera(cam):
+
+def gen_camera(ctx, cam):
     matrix = cam.matrix_world * mathutils.Matrix.Scale(-1,4,(0,0,1))
     
-    yield from gen_transform_matrix(matrix.transposed(), _options['format_xml'])
-    yield write_camera(cam.data)+NL
-    yield '</transform>'+NL
+    yield from gen_transform_matrix(ctx, matrix.transposed(), ctx.options['format_xml'])
+    yield write_camera(cam.data)+ctx.NL
+    yield '</transform>'+ctx.NL
+
+
+def shader_body(ctx, material):
+    ''' the <shader> of material without its name attribute, memoized on
+        the material's node tree '''
+    fingerprint = nodes.node_tree_fingerprint(material)
+    memoize = fingerprint is not None and ctx.textures is None
+    if memoize:
+        memo = _shader_memo.get(material.name)
+        if memo is not None and memo[0] == fingerprint:
+            return memo[1]
+
+    material_node = write_material(material, encoder=ctx.textures)
+    body = None
+    if material_node is not None:
+        material_node.set('name', '')
+        body = etree.tostring(material_node).decode()
+    if memoize:
+        _shader_memo[material.name] = (fingerprint, body)
+    return body
+
+
+def gen_material(ctx, material):
+    ''' writes material's <shader> the first time it, or a structurally
+        identical material, is seen during the export '''
+    if material in ctx.shader_names:
+        return
+
+    with timer(ctx, 'materials', material.name, ctx.stats and ctx.stats.materials):
+        body = shader_body(ctx, material)
+    if body is None:
+        ctx.shader_names[material] = material.name
+    elif body in ctx.shader_bodies:
+        ctx.shader_names[material] = ctx.shader_bodies[body]
+    else:
+        ctx.shader_names[material] = ctx.shader_bodies[body] = material.name
+        if ctx.stats is not None:
+            ctx.stats.count('shaders')
+        yield body.replace('name=""', 'name="'+util.xml_escape(material.name)+'"', 1)+ctx.NL
 
 
 #TODO: try to find a way to avoid passing scene as argument
-def gen_object(obj, scene, matrix_world_extra=None, export_mesh=_options['export_mesh'] ):
-    written_materials = set()
-    has_material = False
+def gen_object(ctx, obj, scene, matrix_world_extra=None, export_mesh=None, mesh_key=None, name=None ):
+    if export_mesh is None:
+        export_mesh = ctx.options['export_mesh']
+    shader = None
 
-    materials = getattr(obj.data, 'materials', []) or getattr(obj, 'materials', [])
-    for material in materials:
+    for material in object_materials(obj):
         if material == None : continue
-        has_material= True
-        if hash(material) not in written_materials:
-            material_node = write_material(material)
-            if material_node is not None:
-                written_materials.add(hash(material))
-                yield etree.tostring(material_node).decode()+NL
+        yield from gen_material(ctx, material)
+        if shader is None:
+            shader = ctx.shader_names[material]
 
     matrix = obj.matrix_world
     if matrix_world_extra :
         matrix = matrix_world_extra * obj.matrix_world
-    
-    yield from gen_transform_matrix(matrix.transposed(), _options['format_xml'])
 
-    if has_material : yield '<state shader="'+materials[0].name+'" >'+NL
+    mesh_key = instance_key(ctx, obj, mesh_key)
+
+    body = gen_object_body(ctx, obj, scene, matrix, shader, export_mesh, mesh_key)
+    fingerprint = None
+    if ctx.fragments is not None:
+        fingerprint = object_fingerprint(ctx, obj, scene, matrix, shader, export_mesh, mesh_key)
+    if fingerprint is None:
+        yield from body
+        return
+
+    data = ctx.fragments.get(name or obj.name, fingerprint)
+    if data is None:
+        data = ''.join(map(util.resolved, body))
+        ctx.fragments.put(fingerprint, data)
+    yield data
+
 
-    if   obj.type in ('MESH','CURVE','FONT','SURFACE'):
-        #TODO if not export_mesh : do something with use gen_xml_includes()
-        yield from gen_mesh(obj.to_mesh(scene, True, 'PREVIEW'))
+def object_materials(obj):
+    return getattr(obj.data, 'materials', []) or getattr(obj, 'materials', [])
+
+
+def gen_object_body(ctx, obj, scene, matrix, shader, export_mesh, mesh_key):
+    yield from gen_transform_matrix(ctx, matrix.transposed(), ctx.options['format_xml'])
+
+    if shader is not None : yield '<state shader="'+util.xml_escape(shader)+'" >'+ctx.NL
+
+    if is_curve(ctx, obj):
+        yield from gen_curves(ctx, curve_arrays(obj.data))
+    elif obj.type in ('MESH','CURVE','FONT','SURFACE'):
+        if mesh_key is not None and ctx.includes is not None:
+            # serialized once, then only referenced
+            if mesh_key not in ctx.mesh_cache:
+                arrays = object_mesh(ctx, obj, scene)
+                ctx.mesh_cache[mesh_key] = list(gen_mesh_include(ctx, arrays))
+            yield from ctx.mesh_cache[mesh_key]
+        elif export_mesh or ctx.includes is None:
+            yield from gen_mesh_data(ctx, object_mesh(ctx, obj, scene))
+        else:
+            yield from gen_mesh_include(ctx, object_mesh(ctx, obj, scene))
+        for psys in hair_systems(ctx, obj):
+            yield from gen_curves(ctx, hair_arrays(psys))
     else : # obj.type == 'LAMP':
-        yield write_light(obj)+NL
+        yield write_light(obj)+ctx.NL
+
+    if shader is not None : yield '</state>'+ctx.NL
+
+    yield '</transform>'+ctx.NL
+
+
+def object_mesh(ctx, obj, scene):
+    ''' the arrays of obj's evaluated mesh, which is freed as soon as they
+        are read rather than left in bpy.data.meshes until blender exits '''
+    mesh = evaluate_mesh(ctx, obj, scene)
+    try:
+        with timer(ctx, 'read_mesh'):
+            return mesh_arrays(ctx, mesh)
+    finally:
+        bpy.data.meshes.remove(mesh)
+
+
+def evaluate_mesh(ctx, obj, scene):
+    with timer(ctx, 'to_mesh'):
+        mesh = obj.to_mesh(scene, True, ctx.settings,
+                           calc_tessface=ctx.options['mesh_source'] == 'tessfaces')
+    budget = face_budget(ctx, obj, scene)
+    if budget is not None and len(mesh.polygons) > budget:
+        mesh = decimate(ctx, mesh, scene, budget)
+    if ctx.stats is not None:
+        ctx.stats.count('meshes')
+        ctx.stats.count('verts', len(mesh.vertices))
+        ctx.stats.count('faces', len(mesh.polygons))
+    return mesh
+
+
+def face_budget(ctx, obj, scene):
+    ''' the most faces obj's mesh is exported with, None when unlimited '''
+    budget = ctx.options['face_budget']
+    faces = len(getattr(obj.data, 'polygons', ()))
+    if ctx.options['scene_face_budget'] is not None and faces:
+        if ctx.scene_faces is None:
+            ctx.scene_faces = sum(len(o.data.polygons) for o in scene.objects
+                                  if o.type == 'MESH' and is_exported(o, scene))
+        share = max(1, ctx.options['scene_face_budget'] * faces // max(1, ctx.scene_faces))
+        budget = share if budget is None else min(budget, share)
+    return budget
 
-    if has_material : yield '</state>'+NL
 
-    yield '</transform>'+NL
+def decimate(ctx, mesh, scene, budget):
+    ''' mesh collapsed to about budget faces, by a decimate modifier on a
+        temporary object holding it; mesh is freed '''
+    faces = len(mesh.polygons)
+    # the collapse ratio counts triangles, and leaves only triangles
+    triangles = len(mesh.loops) - 2*faces
+    holder = bpy.data.objects.new('cycles_xml_decimate', mesh)
+    try:
+        modifier = holder.modifiers.new('Decimate', 'DECIMATE')
+        modifier.ratio = min(1.0, budget / max(1, triangles))
+        with timer(ctx, 'decimate'):
+            decimated = holder.to_mesh(scene, True, ctx.settings,
+                                       calc_tessface=ctx.options['mesh_source'] == 'tessfaces')
+    finally:
+        bpy.data.objects.remove(holder)
+        bpy.data.meshes.remove(mesh)
+    if ctx.stats is not None:
+        ctx.stats.count('decimated_faces', faces - len(decimated.polygons))
+    return decimated
+
+
+def object_fingerprint(ctx, obj, scene, matrix, shader, export_mesh, mesh_key):
+    ''' hash of everything gen_object_body writes for obj, None when that
+        can't be known without evaluating obj '''
+    if obj.type != 'MESH' or hair_systems(ctx, obj):
+        return None
+    modifiers = modifier_state(obj)
+    if modifiers is None:
+        return None
+
+    options = sorted(i for i in ctx.options.items() if i[0] not in _neutral_options)
+    h = hashlib.sha1()
+    h.update(repr((options, ctx.settings, [list(row) for row in matrix], shader, export_mesh,
+                   mesh_key is not None, modifiers, face_budget(ctx, obj, scene))).encode())
+    mesh_state(obj.data, h)
+    return h.hexdigest()
+
+
+def modifier_state(obj, seen=()):
+    ''' settings of obj's modifiers, None when they depend on what is not
+        tracked: an armature's pose, a texture, or a target that is neither
+        a mesh nor an empty '''
+    seen = set(seen) | {obj}
+    state = []
+    for modifier in obj.modifiers:
+        for prop in modifier.bl_rna.properties:
+            if prop.identifier == 'rna_type' or prop.type == 'COLLECTION':
+                continue
+            value = getattr(modifier, prop.identifier)
+            if prop.type == 'POINTER' and isinstance(value, bpy.types.ID):
+                value = target_state(value, seen)
+                if value is None:
+                    return None
+            elif prop.type == 'POINTER' and value is not None:
+                value = getattr(value, 'name', None)
+            elif prop.type != 'POINTER':
+                value = nodes._value(value)
+            state.append((modifier.name, prop.identifier, value))
+    return state
+
+
+def target_state(target, seen):
+    ''' what a modifier reads of target: where it is and, for a mesh, its
+        geometry with its own modifiers; None when that is not tracked '''
+    if not isinstance(target, bpy.types.Object) or target in seen:
+        return None
+    matrix = [list(row) for row in target.matrix_world]
+    if target.type == 'EMPTY':
+        return (target.name, matrix)
+    if target.type != 'MESH':
+        return None
+    modifiers = modifier_state(target, seen)
+    if modifiers is None:
+        return None
+    h = hashlib.sha1(repr(modifiers).encode())
+    mesh_state(target.data, h)
+    return (target.name, matrix, h.hexdigest())
+
+
+def mesh_state(mesh, h):
+    ''' feeds the raw data of mesh to the hash h '''
+    co = util.float_buffer(len(mesh.vertices)*3)
+    mesh.vertices.foreach_get('co', co)
+    h.update(co)
+    corners = util.int_buffer(len(mesh.loops))
+    mesh.loops.foreach_get('vertex_index', corners)
+    h.update(corners)
+    sizes = util.int_buffer(len(mesh.polygons))
+    mesh.polygons.foreach_get('loop_total', sizes)
+    h.update(sizes)
+    for layer in mesh.uv_layers:
+        uv = util.float_buffer(len(mesh.loops)*2)
+        layer.data.foreach_get('uv', uv)
+        h.update(uv)
+    h.update(repr([m.active_render for m in mesh.uv_textures]).encode())
+    if mesh.shape_keys is not None:
+        for block in mesh.shape_keys.key_blocks:
+            h.update(repr((block.name, block.value, block.mute)).encode())
+            co = util.float_buffer(len(block.data)*3)
+            block.data.foreach_get('co', co)
+            h.update(co)
+
+
+def instance_key(ctx, obj, mesh_key=None):
+    ''' the key obj's geometry is written to one include under, for the
+        objects of the same key to reference; None when it is written with
+        obj. mesh_key overrides the key of obj's shared mesh '''
+    if not ctx.options['instance_meshes']:
+        return None
+    if mesh_key is None and obj.type in ('MESH','CURVE','FONT','SURFACE'):
+        return shared_mesh_key(obj, ctx.settings)
+    return mesh_key
+
+
+def shared_mesh_key(obj, settings='PREVIEW'):
+    ''' key of the mesh data obj shares with other objects, None when its
+        evaluated mesh is its own (single user or modifiers applied with
+        settings) '''
+    if getattr(obj.data, 'users', 1) < 2:
+        return None
+    if any(modifier_enabled(m, settings) for m in obj.modifiers):
+        return None
+    return obj.data
+
+
+def modifier_enabled(modifier, settings='PREVIEW'):
+    return modifier.show_viewport if settings == 'PREVIEW' else modifier.show_render
 
 
 def write_camera(camera):
@@ -152,91 +718,795 @@ def write_light(l):
     # TODO export light's shader here? Where? :D ?
     return '<light P="'+' '.join(list(map(str,l.location)))+'" />'
 
-def gen_mesh(mesh):
-    col_align = _options['format_xml'] 
-    head = '<mesh P'
-    sp  = 6 if col_align else 1
-    
-    funcformat = lambda P: ' '.join( ' '.join((str(v.co.x),str(v.co.y),str(v.co.z))) for v in P )
-    yield from gen_list(mesh.vertices, funcformat, head, col_align, 3)
+def mesh_arrays(ctx, mesh):
+    ''' bulk read of positions, face sizes, face indices, active uvs and
+        vertex normals, the last two None when not exported '''
+    if ctx.options['mesh_source'] == 'tessfaces':
+        P, nverts, verts, uv = tessface_arrays(mesh)
+    else:
+        P, nverts, verts, uv = polygon_arrays(mesh)
+    if ctx.options['triangles']:
+        nverts, verts, uv = triangulate(nverts, verts, uv)
 
-    head = ' '*sp + 'nverts'
-    funcformat = lambda faces: ' '.join( str(len(f.vertices)) for f in faces)
-    yield from gen_list(mesh.tessfaces, funcformat, head, col_align, 50)
+    N = None
+    if ctx.options['normals']:
+        N = util.float_buffer(len(mesh.vertices)*3)
+        mesh.vertices.foreach_get('normal', N)
+    return P, nverts, verts, uv, N
 
-    head = ' '*sp+'verts'
-    funcformat = lambda faces: ' '.join( ' '.join( str(i) for i in f.vertices ) for f in faces) 
-    yield from gen_list(mesh.tessfaces, funcformat, head, col_align, 5)
-    
+
+def polygon_arrays(mesh):
+    P = util.float_buffer(len(mesh.vertices)*3)
+    mesh.vertices.foreach_get('co', P)
+
+    nverts = util.int_buffer(len(mesh.polygons))
+    mesh.polygons.foreach_get('loop_total', nverts)
+    starts = util.int_buffer(len(mesh.polygons))
+    mesh.polygons.foreach_get('loop_start', starts)
+    verts = util.int_buffer(len(mesh.loops))
+    mesh.loops.foreach_get('vertex_index', verts)
+
+    uv = None
+    active = [i for i, layer in enumerate(mesh.uv_textures) if layer.active_render]
+    if active:
+        uv = util.float_buffer(len(mesh.loops)*2)
+        mesh.uv_layers[active[0]].data.foreach_get('uv', uv)
+
+    # loops are normally stored face after face, otherwise put them in order
+    ends = util.offsets(nverts)
+    if list(starts) != ends[:-1]:
+        corners = [i for start, n in zip(starts, nverts) for i in range(start, start+n)]
+        verts, uv = gather(verts, uv, corners)
+    return P, nverts, verts, uv
+
+
+def triangulate(nverts, verts, uv):
+    ''' splits faces into triangle fans, as cycles does when reading them '''
+    numpy = util.numpy
+    if numpy is not None:
+        nverts = numpy.asarray(nverts)
+        ntris = nverts - 2
+        first = numpy.repeat(numpy.asarray(util.offsets(nverts)[:-1]), ntris)
+        k = numpy.arange(len(first)) - numpy.repeat(numpy.cumsum(ntris) - ntris, ntris) + 1
+        corners = numpy.stack([first, first+k, first+k+1], axis=1).ravel()
+    else:
+        corners = []
+        start = 0
+        for n in nverts:
+            for k in range(1, n-1):
+                corners += (start, start+k, start+k+1)
+            start += n
+    verts, uv = gather(verts, uv, corners)
+    return [3] * (len(corners) // 3), verts, uv
+
+
+def gather(verts, uv, corners):
+    ''' the vertex indices and uvs of the given face corners '''
+    numpy = util.numpy
+    if numpy is not None:
+        corners = numpy.asarray(corners, dtype=numpy.int64)
+        verts = numpy.asarray(verts)[corners]
+        if uv is not None:
+            uv = numpy.asarray(uv).reshape(-1, 2)[corners].ravel()
+        return verts, uv
+    verts = [verts[i] for i in corners]
+    if uv is not None:
+        uv = list(itertools.chain.from_iterable(uv[2*i:2*i+2] for i in corners))
+    return verts, uv
+
+
+def tessface_arrays(mesh):
+    numpy = util.numpy
+    nfaces = len(mesh.tessfaces)
+
+    P = util.float_buffer(len(mesh.vertices)*3)
+    mesh.vertices.foreach_get('co', P)
+
+    # tessfaces are stored as 4 indices, a 0 in the last one means triangle
+    raw = util.int_buffer(nfaces*4)
+    mesh.tessfaces.foreach_get('vertices_raw', raw)
+
+    uvraw = None
     uvmap = [m for m in mesh.tessface_uv_textures if m.active_render]
     if len(uvmap):
-        uvmap = uvmap[0].data #XXX: what if multiple render active  uvmaps ?
-        head = ' '*sp+'UV'
-        f = None #... 
-        funcformat = lambda uvmap: ' '.join( ' '.join(str(c[0])+' '+str(c[1]) for c in f.uv) for f in uvmap )
-        yield from gen_list(uvmap, funcformat, head, col_align, 1)
+        uvraw = util.float_buffer(nfaces*8) #XXX: what if multiple render active  uvmaps ?
+        uvmap[0].data.foreach_get('uv_raw', uvraw)
+
+    if numpy is not None:
+        raw = raw.reshape(-1, 4)
+        mask = numpy.ones(raw.shape, dtype=bool)
+        mask[:,3] = raw[:,3] != 0
+        nverts = mask.sum(axis=1)
+        verts = raw[mask]
+        if uvraw is not None:
+            uvraw = uvraw.reshape(-1, 4, 2)[mask].ravel()
+    else:
+        raw = raw.tolist()
+        nverts = [4 if v4 else 3 for v4 in raw[3::4]]
+        verts = list(itertools.compress(raw,
+                    itertools.chain.from_iterable((1,1,1,v4) for v4 in raw[3::4])))
+        if uvraw is not None:
+            uvraw = list(itertools.compress(uvraw.tolist(),
+                    itertools.chain.from_iterable((1,1,1,1,1,1,v4,v4) for v4 in raw[3::4])))
+
+    return P, nverts, verts, uvraw
+
+
+def gen_mesh(ctx, mesh):
+    with timer(ctx, 'read_mesh'):
+        arrays = mesh_arrays(ctx, mesh)
+    yield from gen_mesh_data(ctx, arrays)
+
+
+def gen_mesh_data(ctx, arrays):
+    if ctx.pool is not None:
+        # formatted elsewhere, only handing it over is timed
+        with timer(ctx, 'format_mesh'):
+            job = submit_mesh(ctx, arrays, False)
+        yield job
+    else:
+        yield from timed(ctx, 'format_mesh',
+                         gen_mesh_arrays(ctx, arrays, ctx.options['format_xml']))
+
+
+def submit_mesh(ctx, arrays, document):
+    ''' formats arrays in a worker process, or thread, the future of the text '''
+    if isinstance(ctx.pool, concurrent.futures.ThreadPoolExecutor):
+        # threads read the arrays as they are
+        job = ctx.pool.submit(format_mesh, ctx, arrays, document)
+        job.nbytes = 4 * sum(4 * len(a) for a in arrays if a is not None)
+        return job
+    shared = [a if a is None else util.share(a, code) for a, code in zip(arrays, 'fiiff')]
+    shared_arrays = [s for s in shared if s is not None]
+    job = ctx.pool.submit(format_mesh_job, shared, ctx.options, document)
+    job.add_done_callback(lambda job: [util.release(s) for s in shared_arrays])
+    # held until written: the shared copy, then about 3 bytes of text per byte
+    job.nbytes = 4 * sum(s[2] for s in shared_arrays)
+    return job
+
+
+def format_mesh_job(shared, options, document):
+    arrays = [s if s is None else util.unshare(s) for s in shared]
+    return format_mesh(ExportContext(options), arrays, document)
+
+
+def format_mesh(ctx, arrays, document):
+    node = gen_mesh_arrays(ctx, arrays, ctx.options['format_xml'])
+    return ''.join(gen_cycles(ctx, node) if document else node)
+
+
+def gen_mesh_arrays(ctx, arrays, col_align):
+    sp  = 6 if col_align else 1
+    P, nverts, verts, uv, N = arrays
+    faces = util.offsets(nverts)
+
+    yield from gen_array(ctx, P, '<mesh P', col_align, 3, stride=3, tokens=ctx.format_floats)
+    yield from gen_array(ctx, nverts, ' '*sp+'nverts', col_align, 50)
+    yield from gen_array(ctx, verts, ' '*sp+'verts', col_align, 5, offsets=faces)
+    if uv is not None:
+        corners = [2*i for i in faces]
+        yield from gen_array(ctx, uv, ' '*sp+'UV', col_align, 1, offsets=corners,
+                             tokens=ctx.format_floats)
+    if N is not None:
+        yield from gen_array(ctx, N, ' '*sp+'N', col_align, 3, stride=3, tokens=ctx.format_floats)
 
-    yield '/>'+NL
+    yield '/>'+ctx.NL
 
 
-def gen_list(lst, func, header, col_align=True, width=50):
+def is_curve(ctx, obj):
+    ''' True for CURVE objects written as <curves>: round tubes, without
+        bevel object or extrusion; others are turned into meshes '''
+    if not ctx.options['curves'] or obj.type != 'CURVE':
+        return False
+    curve = obj.data
+    return curve.bevel_depth > 0 and curve.bevel_object is None and curve.extrude == 0
+
+
+def hair_systems(ctx, obj):
+    if not ctx.options['curves']:
+        return []
+    return [psys for psys in getattr(obj, 'particle_systems', ())
+                 if psys.settings.type == 'HAIR']
+
+
+def curve_arrays(curve):
+    ''' keys, the radius of every key and the number of keys of every
+        spline of curve '''
+    P = array.array('f')
+    radius = array.array('f')
+    nkeys = array.array('i')
+    for spline in curve.splines:
+        if spline.type == 'BEZIER':
+            keys, radii = bezier_keys(spline, curve.resolution_u)
+        else:
+            n = len(spline.points)
+            co = util.float_buffer(n*4)
+            spline.points.foreach_get('co', co)
+            radii = util.float_buffer(n)
+            spline.points.foreach_get('radius', radii)
+            # points are x y z w, nurbs are approximated by their control points
+            keys = list(itertools.compress(co.tolist(), itertools.cycle((1,1,1,0))))
+            radii = radii.tolist()
+            if spline.use_cyclic_u:
+                keys += keys[:3]
+                radii += radii[:1]
+        P.extend(keys)
+        radius.extend(r * curve.bevel_depth for r in radii)
+        nkeys.append(len(radii))
+    return P, radius, nkeys
+
+
+def bezier_keys(spline, resolution):
+    ''' points sampled along the segments of a bezier spline, resolution
+        per segment as blender does '''
+    n = len(spline.bezier_points)
+    co, left, right = [util.float_buffer(n*3) for i in range(3)]
+    spline.bezier_points.foreach_get('co', co)
+    spline.bezier_points.foreach_get('handle_left', left)
+    spline.bezier_points.foreach_get('handle_right', right)
+    radius = util.float_buffer(n)
+    spline.bezier_points.foreach_get('radius', radius)
+    co, left, right, radius = co.tolist(), left.tolist(), right.tolist(), radius.tolist()
+
+    keys = []
+    radii = []
+    segments = n if spline.use_cyclic_u else n-1
+    for i in range(segments):
+        j = (i+1) % n
+        for step in range(resolution):
+            t = step / resolution
+            s = 1.0 - t
+            a, b, c, d = s*s*s, 3*s*s*t, 3*s*t*t, t*t*t
+            keys += [a*co[3*i+k] + b*right[3*i+k] + c*left[3*j+k] + d*co[3*j+k]
+                     for k in range(3)]
+            radii.append(s*radius[i] + t*radius[j])
+    last = 0 if spline.use_cyclic_u else n-1
+    keys += co[3*last:3*last+3]
+    radii.append(radius[last])
+    return keys, radii
+
+
+def hair_arrays(psys):
+    ''' the keys of every hair of a particle system, in object space; the
+        radius goes from root to tip width like cycles' hair settings '''
+    cycles = getattr(psys.settings, 'cycles', None)
+    scale = getattr(cycles, 'radius_scale', 0.01) * 0.5
+    root = getattr(cycles, 'root_width', 1.0) * scale
+    tip = getattr(cycles, 'tip_width', 0.0) * scale
+
+    P = array.array('f')
+    radius = array.array('f')
+    nkeys = array.array('i')
+    for particle in psys.particles:
+        n = len(particle.hair_keys)
+        co = util.float_buffer(n*3)
+        particle.hair_keys.foreach_get('co', co)
+        P.frombytes(co.tobytes())
+        radius.extend(root + (tip-root) * k / max(n-1, 1) for k in range(n))
+        nkeys.append(n)
+    return P, radius, nkeys
+
+
+def gen_curves(ctx, arrays):
+    if ctx.stats is not None:
+        ctx.stats.count('curves', len(arrays[2]))
+        ctx.stats.count('keys', len(arrays[1]))
+    yield from timed(ctx, 'format_curves',
+                     gen_curve_arrays(ctx, arrays, ctx.options['format_xml']))
+
+
+def gen_curve_arrays(ctx, arrays, col_align):
+    sp = 8 if col_align else 1
+    P, radius, nkeys = arrays
+    keys = util.offsets(nkeys)
+
+    yield from gen_array(ctx, P, '<curves P', col_align, 3, stride=3, tokens=ctx.format_floats)
+    yield from gen_array(ctx, radius, ' '*sp+'radius', col_align, 1, offsets=keys,
+                         tokens=ctx.format_floats)
+    yield from gen_array(ctx, nkeys, ' '*sp+'nkeys', col_align, 50)
+    yield '/>'+ctx.NL
+
+
+def gen_list(ctx, lst, func, header, col_align=True, width=50):
     padding = (' '*(len(header)+2)) if col_align else ''
     bs=width
     size = len(lst)
     if size > bs:
-        yield header + '="' + func(lst[:bs]) + NL
+        yield header + '="' + func(lst[:bs]) + ctx.NL
         i=bs
         while i+bs < size :
-            yield padding + func(lst[i:i+bs]) + NL
+            yield padding + func(lst[i:i+bs]) + ctx.NL
             i += bs
 
-        yield padding + func(lst[i:]) + '"' + NL
+        yield padding + func(lst[i:]) + '"' + ctx.NL
     elif size == 0:
-        yield header + '=""' + NL
+        yield header + '=""' + ctx.NL
     else:
-        yield header + '="' + func(lst) + '"' + NL
+        yield header + '="' + func(lst) + '"' + ctx.NL
+
+
+def format_ints(values):
+    return list(map(str, values.tolist() if hasattr(values, 'tolist') else values))
+
+
+def gen_array(ctx, values, header, col_align=True, width=50, stride=1, offsets=None,
+              tokens=format_ints):
+    ''' same lines as gen_list, for a flat array of numbers where item i
+        is values[offsets[i]:offsets[i+1]] (or `stride` values wide), yielded
+        in chunks of about the chunk_size option's bytes '''
+    if offsets is None:
+        offsets = range(0, len(values)+1, stride)
+    size = len(offsets) - 1
+    if size <= 0:
+        yield header + '=""' + ctx.NL
+        return
+    if not ctx.options['wrap']:
+        yield from gen_array_line(ctx, values, header, tokens)
+        return
+
+    padding = (' '*(len(header)+2)) if col_align else ''
+    budget = ctx.options['chunk_size']
+    first = 0
+    nlines = 16 # until the size of a line is known
+    while first < size:
+        lo = offsets[first]
+        hi = offsets[min(first + nlines*width, size)]
+        chunk = tokens(values[lo:hi])
+        lines = []
+        for first in range(first, min(first + nlines*width, size), width):
+            last = min(first+width, size)
+            lines.append((header+'="' if first == 0 else padding) +
+                         ' '.join(chunk[offsets[first]-lo:offsets[last]-lo]))
+        first = last
+        if last == size:
+            lines[-1] += '"'
+        lines.append('')
+        data = ctx.NL.join(lines)
+        yield data
+        nlines = max(1, nlines * budget // len(data))
+
 
+def gen_array_line(ctx, values, header, tokens=format_ints):
+    ''' values as one line, still yielded in chunks of about chunk_size bytes '''
+    budget = ctx.options['chunk_size']
+    size = len(values)
+    data = header + '="'
+    lo = 0
+    step = 1024 # until the size of a token is known
+    while lo < size:
+        hi = min(lo + step, size)
+        chunk = ' '.join(tokens(values[lo:hi]))
+        data += (' ' if lo else '') + chunk
+        if hi == size:
+            data += '"' + ctx.NL
+        yield data
+        data = ''
+        step = max(1, step * budget // (len(chunk) + 1))
+        lo = hi
 
-def gen_transform_matrix(mat,col_align=True):
-    l = lambda mat: util.write_vector(mat[0])
-    yield from gen_list(mat, l, '<transform matrix', col_align, 1)
-    yield '>' + NL
 
+def gen_transform_matrix(ctx, mat,col_align=True):
+    l = lambda rows: ' '.join(ctx.format_floats([v for row in rows for v in row]))
+    width = 1 if ctx.options['wrap'] else 4
+    yield from gen_list(ctx, mat, l, '<transform matrix', col_align, width)
+    yield '>' + ctx.NL
 
-def gen_auto(data, args = {bpy.types.Scene : (gen_scene_nodes, ),
-                           #bpy.types.Object: (gen_object, (sc ),
-                           bpy.types.Mesh  : (gen_mesh, ),
-                          }):
+
+def gen_auto(ctx, data, args = {bpy.types.Scene : (gen_scene_nodes, ),
+                                #bpy.types.Object: (gen_object, (sc ),
+                                bpy.types.Mesh  : (gen_mesh, ),
+                               }):
     meta = args[type(data)]
-    yield from meta[0](data, *meta[1:] if len(meta)>1 else ())
+    yield from meta[0](ctx, data, *meta[1:] if len(meta)>1 else ())
+
+
+def write_budget(ctx):
+    ''' bytes util.writer buffers, a small part of the memory budget '''
+    return min(util.WRITE_BUDGET, ctx.options['memory_budget'] // 16)
+
+
+def timer(ctx, stage, name=None, table=None):
+    ''' times a with block as stage, when collecting stats '''
+    return stats.Timer(ctx.stats, stage, name, table)
+
+
+def timed(ctx, stage, node):
+    return node if ctx.stats is None else ctx.stats.timed(stage, node)
+
+
+def timed_object(ctx, name, node):
+    ''' node, exporting object `name`, timed and counted when collecting stats '''
+    if ctx.stats is None:
+        return node
+    return ctx.stats.timed_object(name, ctx.stats.counted('bytes', node, name))
+
+
+def owns_process():
+    ''' True when the export is all the process runs: blender in background
+        mode, as batch.py starts it, with no other python thread '''
+    return bpy.app.background and threading.active_count() == 1
+
+
+def worker_pool(workers):
+    ''' processes formatting meshes, forked so they already have this module
+        without importing bpy. A child only gets the thread that forked it,
+        and locks other threads held stay held in it, so forking is left to
+        exports that own the process; other exports, and platforms without
+        fork, format meshes on threads '''
+    if not owns_process() or 'fork' not in multiprocessing.get_all_start_methods():
+        return concurrent.futures.ThreadPoolExecutor(workers)
+    util.start_sharing()
+    pool = concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('fork'))
+    # the first submit forks all of them, before the export starts threads
+    pool.submit(os.getpid)
+    return pool
 
 
-def export_ninja(filepath, jas ):
+def begin_export(filepath, options=None):
+    ''' the context of an export to filepath, options overriding _options
+        for it only; end_export() it once written '''
+    ctx = ExportContext(options)
+    if ctx.options['workers']:
+        ctx.pool = worker_pool(ctx.options['workers'])
+    # without a filepath, only a stream, nothing is written to files
+    if filepath is not None:
+        ext = util.compression_ext(filepath)
+        base = os.path.splitext(filepath[:len(filepath)-len(ext)])[0]
+        if ctx.options['stats'] or ctx.options['profile']:
+            ctx.stats = stats.ExportStats(base + '.stats.json',
+                                          base + '.prof' if ctx.options['profile'] else None)
+        ctx.includes = util.IncludeWriter(base + '_meshes', ctx.options['include_workers'],
+                                          '.xml'+ext, ctx.options['memory_budget'])
+        if ctx.options['incremental']:
+            ctx.fragments = cache.FragmentCache(base + '_cache', base + '.manifest.json')
+    if not ctx.options['inline_textures']:
+        ctx.textures = textures.TextureEncoder(ctx.options['texture_cache'],
+                                               ctx.options['texture_workers'])
+    return ctx
+
+
+def end_export(ctx):
+    ''' returns the report of the export: the fragment cache's under 'cache'
+        for incremental exports, the timings under 'stats' when collected '''
+    report = {}
+    texture_report = None
+    if ctx.pool is not None:
+        ctx.pool.shutdown(wait=True)
+        ctx.pool = None
+    if ctx.includes is not None:
+        ctx.includes.close()
+        ctx.includes = None
+    if ctx.textures is not None:
+        texture_report = ctx.textures.close()
+        ctx.textures = None
+    if ctx.fragments is not None:
+        cache_report = report['cache'] = ctx.fragments.close(
+            ctx.options['cache_max_bytes'], ctx.options['cache_max_age'])
+        print('Fragment cache: %d hits, %d misses, %d dirty, %d evicted' % (
+            cache_report['hits'], cache_report['misses'],
+            len(cache_report['dirty']), cache_report['evicted']))
+        ctx.fragments = None
+    if ctx.stats is not None:
+        stats_report = report['stats'] = ctx.stats.close(texture_report)
+        print('Export stats: %.2fs, slowest objects: %s (%s)' % (
+            stats_report['seconds'], ', '.join(stats_report['slowest'][:3]),
+            ctx.stats.filepath))
+        ctx.stats = None
+    ctx.mesh_cache.clear()
+    written = {material.name for material in ctx.shader_names}
+    for name in list(_shader_memo):
+        if name not in written:
+            _shader_memo.pop(name, None)
+    ctx.shader_names.clear()
+    ctx.shader_bodies.clear()
+    return report
+
+
+def export_ninja(filepath, jas, **options):
     ''' omg export function for ninjas !!!'''
-    f = util.writer(filepath)
-    f.send('<cycles>'+NL)
-    for n in jas: #only
-        nodes = gen_auto(*n)
-        xml = format(nodes)
-        for data in xml:
-            f.send(data)
-    f.send('</cycles>')
-    f.close()
+    ctx = begin_export(filepath, options)
+    try:
+        f = util.writer(filepath, write_budget(ctx))
+        f.send('<cycles>'+ctx.NL)
+        for n in jas: #only
+            nodes = util.ordered(gen_auto(ctx, *n), 4*ctx.options['workers'],
+                                 ctx.options['memory_budget'])
+            xml = ctx.format(nodes)
+            for data in xml:
+                f.send(data)
+        f.send('</cycles>')
+        f.close()
+    except BaseException:
+        end_export(ctx)
+        raise
+    return end_export(ctx)
 
 
-def export(filepath, export_data):
-    f = util.writer(filepath)
-    nodes = gen_auto(export_data)
-    xml = gen_cycles(nodes)
+def write_xml(ctx, filepath, xml):
+    if ctx.stats is not None:
+        xml = ctx.stats.counted('bytes_written', xml)
+    f = util.writer(filepath, write_budget(ctx))
     for data in xml:
         f.send(data)
-
     f.close()
 
 
-def export_scene(filepath, scene):
-    export(filepath, scene)
+def export(filepath, export_data, **options):
+    ''' options override _options for this export only, e.g. output='compact' '''
+    ctx = begin_export(filepath, options)
+    try:
+        write_xml(ctx, filepath, gen_cycles(ctx, gen_auto(ctx, export_data)))
+    except BaseException:
+        end_export(ctx)
+        raise
+    return end_export(ctx)
+
+
+def export_scene(filepath, scene, **options):
+    return export(filepath, scene, **options)
+
+def export_stream(sink, scene, filepath=None, **options):
+    ''' writes scene to sink, an open file, pipe or socket, as it is
+        exported. Film, camera and shaders come first, and are flushed at
+        once so the reader can start on them while objects are evaluated.
+        All geometry is in the stream, as the reader can't resolve include
+        files; only with filepath are include files and reports written,
+        named as if the stream was written there '''
+    if filepath is None:
+        files = [key for key in ('stats', 'profile', 'incremental') if options.get(key)]
+        if files:
+            raise ValueError('%s need a filepath to write files next to' % ', '.join(files))
+        options = dict(options, instance_meshes=False, export_mesh=True)
+    ctx = begin_export(filepath, options)
+    try:
+        f = util.writer(sink, write_budget(ctx))
+        header = ctx.format(gen_scene_header(ctx, scene, shaders=True))
+        objects = ctx.format(util.ordered(gen_scene_objects(ctx, scene),
+                                          4*ctx.options['workers'], ctx.options['memory_budget']))
+        for xml in (itertools.chain(['<cycles>'+ctx.NL], header),
+                    itertools.chain(objects, ['</cycles>'+ctx.NL])):
+            if ctx.stats is not None:
+                xml = ctx.stats.counted('bytes_written', xml)
+            for data in xml:
+                f.send(data)
+            f.send(util.FLUSH)
+        f.close()
+    except BaseException:
+        end_export(ctx)
+        raise
+    return end_export(ctx)
+
+def export_mesh(filepath, mesh, **options):
+    return export(filepath, mesh, **options)
+
+
+class BackgroundExport:
+    ''' export of a scene driven a slice at a time from blender's main
+        thread: step() evaluates objects, which needs blender, while a
+        worker thread formats and writes what it is handed. The scene is
+        written next to filepath and only replaces it once complete, so
+        cancel() leaves nothing partial behind; mesh includes are only ever
+        written whole, and are kept for the next export to reuse '''
+
+    def __init__(self, filepath, scene, backlog=256, **options):
+        self.ctx = ctx = begin_export(filepath, options)
+        self.filepath = filepath
+        ext = util.compression_ext(filepath)
+        self.tmppath = filepath[:len(filepath)-len(ext)] + '.part%d' % os.getpid() + ext
+        # meshes are formatted off the main thread, by the worker processes
+        # when there are some
+        if ctx.pool is None:
+            ctx.pool = concurrent.futures.ThreadPoolExecutor(1)
+        self.done, self.total = 0, len(scene.objects)
+        self.node = gen_scene_nodes(ctx, scene, self.progressed)
+        self.backlog = backlog
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def progressed(self, done, total):
+        self.done, self.total = done, total
+
+    @property
+    def progress(self):
+        ''' fraction of the objects evaluated '''
+        return self.done / self.total if self.total else 1.0
+
+    def step(self, seconds=0.05):
+        ''' evaluates for about `seconds`, not at all while the writer is
+            behind; False once everything was handed to the writer, or it
+            failed, finish() tells which '''
+        end = time.perf_counter() + seconds
+        while self.node is not None and self.error is None:
+            if self.queue.qsize() >= self.backlog:
+                return True
+            item = next(self.node, self)
+            if item is self:
+                self.done = self.total
+                self.node = None
+                self.queue.put(None)
+                return False
+            self.queue.put(item)
+            if time.perf_counter() >= end:
+                return True
+        return False
+
+    def write(self):
+        try:
+            write_xml(self.ctx, self.tmppath, gen_cycles(self.ctx, self.received()))
+        except BaseException as error:
+            self.error = error
+
+    def received(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            yield item
+
+    def writing(self):
+        return self.thread.is_alive()
+
+    def finish(self):
+        ''' waits for the writer and moves the file in place, returns the
+            report of the export '''
+        if self.node is not None:
+            self.node.close()
+            self.queue.put(None)
+        self.thread.join()
+        report = end_export(self.ctx)
+        if self.error is not None:
+            self.remove()
+            raise self.error
+        os.replace(self.tmppath, self.filepath)
+        return report
+
+    def cancel(self):
+        ''' stops evaluating, waits for the writer, removes what it wrote '''
+        if self.node is not None:
+            self.node.close()
+            self.node = None
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(None)
+        self.thread.join()
+        end_export(self.ctx)
+        self.remove()
+
+    def remove(self):
+        if os.path.exists(self.tmppath):
+            os.remove(self.tmppath)
+
+
+def is_deforming(obj, scene, settings='PREVIEW'):
+    ''' True when obj's evaluated geometry may change from frame to frame '''
+    if obj.type == 'LAMP':
+        return False
+    if obj.is_deform_modified(scene, settings):
+        return True
+    keys = getattr(obj.data, 'shape_keys', None)
+    return bool(getattr(obj.data, 'animation_data', None) or
+                (keys is not None and keys.animation_data))
+
+
+def instances_state(obj, scene, settings='PREVIEW'):
+    ''' (hash of where the instances obj makes are, the objects it
+        instances); (None, ()) when it makes none '''
+    if obj.dupli_type == 'GROUP':
+        members = list(obj.dupli_group.objects)
+        return hash(tuple(tuple(tuple(row) for row in member.matrix_world)
+                          for member in members)), members
+    if obj.dupli_type not in ('VERTS', 'FACES') and not particle_instancers(obj):
+        return None, ()
+    obj.dupli_list_create(scene, settings)
+    try:
+        duplis = obj.dupli_list
+        matrices = util.float_buffer(len(duplis)*16)
+        duplis.foreach_get('matrix', matrices)
+        hidden = util.int_buffer(len(duplis))
+        duplis.foreach_get('hide', hidden)
+        sources = {dupli.object for dupli in duplis}
+    finally:
+        obj.dupli_list_clear()
+    return hashlib.sha1(bytes(matrices) + bytes(hidden)).hexdigest(), sources
+
+
+def classify_objects(scene, objects, frames, settings='PREVIEW'):
+    ''' 'static', 'transform' (only its matrix moves) or 'deforming' for
+        each object, from a pass over the frames that evaluates no mesh '''
+    matrices = { obj: set() for obj in objects }
+    sources = { obj: set() for obj in objects }
+    for frame in frames:
+        scene.frame_set(frame)
+        for obj in objects:
+            state, instanced = instances_state(obj, scene, settings)
+            matrices[obj].add((tuple(tuple(row) for row in obj.matrix_world), state))
+            sources[obj].update(instanced)
+
+    kinds = {}
+    for obj in objects:
+        if is_deforming(obj, scene, settings) or any(
+                is_deforming(source, scene, settings) for source in sources[obj]):
+            # deforming, or instancing objects that deform
+            kinds[obj] = 'deforming'
+        elif len(matrices[obj]) > 1:
+            # moving, or making instances that move
+            kinds[obj] = 'transform'
+        else:
+            kinds[obj] = 'static'
+    return kinds
+
+
+def gen_animation_shared(ctx, scene, objects, kinds):
+    ''' what stays the same on every frame: shaders and static objects '''
+    yield from gen_background(ctx, scene)
+    for obj in objects:
+        for material in object_materials(obj):
+            if material is not None:
+                yield from gen_material(ctx, material)
+    for obj in objects:
+        if kinds[obj] == 'static':
+            yield from gen_scene_object(ctx, obj, scene)
+
+
+def gen_animation_frame(ctx, scene, objects, kinds, shared_src):
+    yield write_film(scene)+ctx.NL
+    yield from gen_camera(ctx, scene.camera)
+    yield '<include src="'+shared_src+'" />'+ctx.NL
+    # deforming geometry is evaluated again on every frame, and only shared
+    # between the objects of the frame
+    frame_meshes = {}
+    for obj in objects:
+        if kinds[obj] == 'transform':
+            # the geometry doesn't change, only written on the first frame
+            yield from gen_scene_object(ctx, obj, scene, mesh_key=('ANIMATED', obj))
+        elif kinds[obj] == 'deforming':
+            meshes, ctx.mesh_cache = ctx.mesh_cache, frame_meshes
+            try:
+                yield from gen_scene_object(ctx, obj, scene)
+            finally:
+                ctx.mesh_cache = meshes
+
+
+def export_animation(filepath, scene, frame_start=None, frame_end=None, **options):
+    ''' exports frames frame_start..frame_end (the scene's range by default)
+        to <name>_0001.xml etc, all including <name>_shared.xml '''
+    if frame_start is None : frame_start = scene.frame_start
+    if frame_end is None : frame_end = scene.frame_end
+    frames = range(frame_start, frame_end+1)
+
+    ext = util.compression_ext(filepath)
+    base, xmlext = os.path.splitext(filepath[:len(filepath)-len(ext)])
+    shared = base + '_shared' + xmlext + ext
+
+    objects = [obj for obj in scene.objects if is_exported(obj, scene)]
+    frame_current = scene.frame_current
+    ctx = begin_export(filepath, options)
+    try:
+        prefetch_textures(ctx, scene)
+        kinds = classify_objects(scene, objects, frames, ctx.settings)
 
-def export_mesh(filepath, mesh):
-    export(filepath, mesh)
+        scene.frame_set(frame_start)
+        write_xml(ctx, shared, gen_cycles(ctx, gen_animation_shared(ctx, scene, objects, kinds)))
+        for frame in frames:
+            scene.frame_set(frame)
+            write_xml(ctx, base + '_%04d' % frame + xmlext + ext, gen_cycles(ctx,
+                gen_animation_frame(ctx, scene, objects, kinds, os.path.basename(shared))))
+    except BaseException:
+        end_export(ctx)
+        raise
+    finally:
+        scene.frame_set(frame_current)
 
+    report = { kind: sorted(obj.name for obj in objects if kinds[obj] == kind)
+               for kind in ('static', 'transform', 'deforming') }
+    report['frames'] = len(frames)
+    report.update(end_export(ctx))
+    print('Animation: %d frames, %d static, %d transform only, %d deforming objects' % (
+        len(frames), len(report['static']), len(report['transform']), len(report['deforming'])))
+    return report
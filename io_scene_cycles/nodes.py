@@ -1,11 +1,8 @@
 
-import random
+import hashlib
 import xml.etree.ElementTree as etree
 
-from . import util
-
-#_options = export_cycles._options
-_options = {'inline_textures' : True}
+from . import textures, util
 
 #           blender        <--->     cycles
 xlate = ( ("RGB",                   "color",()),
@@ -28,18 +25,15 @@ xlate = ( ("RGB",                   "color",()),
           ("NEW_GEOMETRY",          "geometry",()),
         )
 
+_xlate_types = { blender: cycles for blender, cycles, sockets in xlate }
+_xlate_sockets = { blender: dict(sockets) for blender, cycles, sockets in xlate }
+
 def xlateSocket(typename, socketname):
-    for i in xlate:
-        if i[0]==typename:
-            for j in i[2]:
-                if j[0]==socketname:
-                    return j[1]
-    return socketname
+    return _xlate_sockets.get(typename, {}).get(socketname, socketname)
 
 def xlateType(typename ):
-    for i in xlate:
-        if i[0]==typename:
-            return i[1]
+    if typename in _xlate_types:
+        return _xlate_types[typename]
     if typename.startswith('BSDF_'):
         return typename.split('_')[1].lower()+'_bsdf'
     return typename.lower()
@@ -53,34 +47,42 @@ def isConnected(socket, links):
 def is_output(node):
     return node.type in ('OUTPUT', 'OUTPUT_MATERIAL', 'OUTPUT_WORLD')
 
+def socket_suffixes(node):
+    ''' socketIndex() of every socket of node, by socket pointer '''
+    suffixes = {}
+    for sockets in (node.inputs, node.outputs):
+        counts = {}
+        for s in sockets:
+            counts[s.name] = counts.get(s.name, 0) + 1
+        seen = {}
+        for s in sockets:
+            seen[s.name] = seen.get(s.name, 0) + 1
+            suffixes[s.as_pointer()] = str(seen[s.name]) if counts[s.name] > 1 else ''
+    return suffixes
+
 def socketIndex(node, socket):
-    socketindex=0
-    countname=0
-    for i in node.inputs:
-        if i.name == socket.name:
-         countname += 1
-         if i==socket:
-            socketindex=countname
-    if socketindex>0:
-        if countname>1:
-            return str(socketindex)
-        else:
-            return ''
-    countname=0
-    for i in node.outputs:
-        if i.name == socket.name:
-            countname += 1
-            if i==socket:
-                socketindex=countname
-    if socketindex>0:
-        if countname>1:
-            return str(socketindex)
-    return ''
+    return socket_suffixes(node).get(socket.as_pointer(), '')
+
+def index_tree(nodes, links):
+    ''' built once per tree by write_material: the pointers of every linked
+        socket, and the socketIndex() of every socket '''
+    connected = set()
+    for link in links:
+        connected.add(link.from_socket.as_pointer())
+        connected.add(link.to_socket.as_pointer())
+    suffixes = {}
+    for node in nodes:
+        suffixes.update(socket_suffixes(node))
+    return connected, suffixes
  
-def socket_name(socket, node):
+def socket_name(socket, node, suffixes=None):
     # TODO don't do this. If it has a space, don't trust there's
     # no other with the same name but with underscores instead of spaces.
-    return xlateSocket(node.type, socket.name.replace(' ', '')) + socketIndex(node, socket)
+    if suffixes is None:
+        suffix = socketIndex(node, socket)
+    else:
+        suffix = suffixes[socket.as_pointer()]
+    return xlateSocket(node.type, socket.name.replace(' ', '')) + suffix
 
 def shader_node_name(node):
     if is_output(node):
@@ -88,29 +90,16 @@ def shader_node_name(node):
 
     return node.name.replace(' ', '_')
 
-def special_node_attrs(node):
+def special_node_attrs(node, encoder=None):
+    ''' encoder is the TextureEncoder embedding images, which are only
+        referenced by path without one '''
     def image_src(image):
-        path = node.image.filepath_raw
-        if path.startswith('//'):
-            path = path[2:]
+        path = textures.image_path(image)
 
-        if _options['inline_textures']:
+        if encoder is None:
             return { 'src': path }
-        else:
-            import base64
-            w, h = image.size
-            image = image.copy()
-            newimage = bpy.data.images.new('/tmp/cycles_export', width=w, height=h)
-            newimage.file_format = 'PNG'
-            newimage.pixels = [pix for pix in image.pixels]
-            newimage.filepath_raw = '/tmp/cycles_export'
-            newimage.save()
-            with open('/tmp/cycles_export', 'rb') as fp:
-                return {
-                    'src': path,
-                    'inline': base64.b64encode(fp.read()).decode('ascii')
-                }
-        
+        return { 'src': path, 'inline': encoder.inline(image) }
+
     if node.type == 'TEX_IMAGE' and node.image is not None:
         return image_src(node.image)
     elif node.type == 'RGB':
@@ -127,13 +116,17 @@ def special_node_attrs(node):
     return {}
 
 
-def gen_shader_node_tree(nodes,links,connect_later):
+def gen_shader_node_tree(nodes,links,connect_later,index=None,encoder=None):
+    if index is None:
+        index = index_tree(nodes, links)
+    connected, suffixes = index
+
     for node in nodes:
         node_attrs = { 'name': shader_node_name(node) }
         node_name = xlateType(node.type)
 
         for input in node.inputs:
-            if isConnected(input,links):
+            if input.as_pointer() in connected:
                 continue
             if not hasattr(input,'default_value'):
                 continue
@@ -160,9 +153,9 @@ def gen_shader_node_tree(nodes,links,connect_later):
                 continue
 
             if el is not None:
-                el.attrib['name'] = input.name + ''.join(
-                    random.choice('abcdef')
-                    for x in range(5))
+                # named after the socket it feeds, so the output is stable
+                el.attrib['name'] = shader_node_name(node) + '_' + (
+                    input.name.replace(' ', '_') + suffixes[input.as_pointer()])
 
                 connect_later.append((
                     el.attrib['name'],
@@ -172,11 +165,36 @@ def gen_shader_node_tree(nodes,links,connect_later):
                 ))
                 yield el
 
-        node_attrs.update(special_node_attrs(node))
+        node_attrs.update(special_node_attrs(node, encoder))
         yield etree.Element(node_name, node_attrs)
 
+def _value(v):
+    try:
+        return tuple(v)
+    except TypeError:
+        return v
+
+def node_tree_fingerprint(material):
+    ''' hash of everything write_material reads from the node tree,
+        None for materials without nodes '''
+    if not material.use_nodes or material.node_tree is None:
+        return None
+
+    h = hashlib.sha1()
+    for node in material.node_tree.nodes:
+        image = getattr(node, 'image', None)
+        h.update(repr((node.type, node.name,
+                       image and (image.name, image.filepath_raw))).encode())
+        for socket in list(node.inputs) + list(node.outputs):
+            h.update(repr((socket.name, socket.type,
+                           _value(getattr(socket, 'default_value', None)))).encode())
+    for link in material.node_tree.links:
+        h.update(repr((link.from_node.name, link.from_socket.identifier,
+                       link.to_node.name, link.to_socket.identifier)).encode())
+    return h.hexdigest()
+
 # from the Node Wrangler, by Barte
-def write_material(material, tag_name='shader'):
+def write_material(material, tag_name='shader', encoder=None):
 #    pass
 #def gen_material(material, tag_name='shader'):
     did_copy = False
@@ -202,8 +220,10 @@ def write_material(material, tag_name='shader'):
     # tag_name is usually 'shader' but could be 'background' for world shaders
     shader = etree.Element(tag_name, { 'name': material.name })
     connect_later = []
+    index = index_tree(node_tree.nodes, links)
+    suffixes = index[1]
 
-    for snode in gen_shader_node_tree(nodes,links,connect_later):
+    for snode in gen_shader_node_tree(nodes,links,connect_later,index,encoder):
         if snode is not None:
             shader.append(snode)
 
@@ -211,8 +231,8 @@ def write_material(material, tag_name='shader'):
         from_node = shader_node_name(link.from_node)
         to_node = shader_node_name(link.to_node)
 
-        from_socket = socket_name(link.from_socket, node=link.from_node)
-        to_socket = socket_name(link.to_socket, node=link.to_node)
+        from_socket = socket_name(link.from_socket, link.from_node, suffixes)
+        to_socket = socket_name(link.to_socket, link.to_node, suffixes)
 
         shader.append(etree.Element('connect', {
             'from': '%s %s' % (from_node, from_socket.replace(' ', '_')),
@@ -230,7 +250,7 @@ def write_material(material, tag_name='shader'):
         to_node = shader_node_name(tn)
 
         from_socket = fs
-        to_socket = socket_name(ts, node=tn)
+        to_socket = socket_name(ts, tn, suffixes)
 
         shader.append(etree.Element('connect', {
             'from': '%s %s' % (from_node, from_socket.replace(' ', '_')),
@@ -0,0 +1,384 @@
+
+# Dry run of an export: walks the objects gen_scene_objects() would export,
+# and estimates what each one writes and how long it takes, without
+# evaluating their meshes or formatting anything.
+#
+# Mesh sizes are worked out from the mesh data and the modifier stack
+# (subdivision, arrays, mirrors, decimation, triangulation), curves and
+# instances are counted, and only geometry that can't be estimated (text,
+# surfaces, curves turned into meshes) is evaluated. Counts are turned into
+# bytes and seconds by a profile, calibrate() measures one from a real
+# export of a representative scene, on the machine and with the options the
+# real exports will use.
+
+import json
+import os
+import time
+
+import bpy
+
+from . import export_cycles, nodes, validate
+
+# the stand-in's numbers with the default output profile, replace them with
+# a profile calibrate() measured in blender
+DEFAULT_PROFILE = {
+    'float_bytes'          : 20.0,  # a float of a mesh or curve, with its separator
+    'index_bytes'          : 5.0,   # a vertex index or count
+    'object_bytes'         : 230.0, # transform, state and include around an object
+    'instance_bytes'       : 240.0, # transform around an instance
+    'node_bytes'           : 70.0,  # a node or connect of a shader
+    'scene_bytes'          : 320.0, # film, camera and the document
+    'seconds_per_value'    : 1e-6,  # evaluating, reading and formatting one number
+    'seconds_per_node'     : 5e-6,
+    'seconds_per_instance' : 2e-5,
+    'seconds_per_object'   : 4e-3,
+}
+
+# attributes of <mesh> and <curves> holding floats, and indices or counts
+_float_arrays = ('P', 'UV', 'N', 'radius')
+_index_arrays = ('nverts', 'verts', 'nkeys')
+
+
+def load_profile(filepath=None):
+    ''' the profile saved at filepath, DEFAULT_PROFILE without one '''
+    profile = dict(DEFAULT_PROFILE)
+    if filepath is not None:
+        with open(filepath) as fp:
+            profile.update(json.load(fp)['profile'])
+    return profile
+
+
+def subdivide(counts, levels):
+    ''' counts of a mesh subdivided levels times: every n-gon becomes n
+        quads, with a vertex on every edge and face '''
+    verts, faces, corners = counts
+    for level in range(levels):
+        # closed meshes have about one edge per two corners
+        verts, faces, corners = verts + corners // 2 + faces, corners, 4 * corners
+    return verts, faces, corners
+
+
+def modified_counts(obj, settings):
+    ''' (verts, faces, corners) of obj's mesh after its modifiers '''
+    mesh = obj.data
+    counts = len(mesh.vertices), len(mesh.polygons), len(mesh.loops)
+    for modifier in obj.modifiers:
+        if not export_cycles.modifier_enabled(modifier, settings):
+            continue
+        verts, faces, corners = counts
+        if modifier.type == 'SUBSURF':
+            levels = modifier.levels if settings == 'PREVIEW' else modifier.render_levels
+            counts = subdivide(counts, levels)
+        elif modifier.type == 'MULTIRES':
+            levels = modifier.preview_levels if settings == 'PREVIEW' else modifier.render_levels
+            counts = subdivide(counts, levels)
+        elif modifier.type == 'ARRAY' and modifier.fit_type == 'FIXED_COUNT':
+            counts = tuple(n * modifier.count for n in counts)
+        elif modifier.type == 'MIRROR':
+            copies = 2 ** sum(map(bool, (modifier.use_x, modifier.use_y, modifier.use_z)))
+            counts = tuple(n * copies for n in counts)
+        elif modifier.type == 'DECIMATE' and modifier.decimate_type == 'COLLAPSE':
+            triangles = int((corners - 2 * faces) * modifier.ratio)
+            counts = int(verts * modifier.ratio), triangles, 3 * triangles
+        elif modifier.type == 'TRIANGULATE':
+            counts = verts, corners - 2 * faces, 3 * (corners - 2 * faces)
+    return counts
+
+
+def material_graph(material):
+    ''' nodes and links of material's node tree, and the elements and
+        connects write_material() makes of them, one more of each for every
+        unlinked color or value input '''
+    graph = { 'nodes': 0, 'links': 0, 'elements': 0, 'connects': 0 }
+    if not material.use_nodes or material.node_tree is None:
+        return graph
+    tree = material.node_tree
+    linked = { link.to_socket.as_pointer() for link in tree.links }
+    for node in tree.nodes:
+        if nodes.is_output(node):
+            continue
+        defaults = sum(1 for socket in node.inputs
+                         if socket.as_pointer() not in linked and socket.type in ('RGBA', 'VALUE')
+                            and hasattr(socket, 'default_value'))
+        graph['nodes'] += 1
+        graph['elements'] += 1 + defaults
+        graph['connects'] += defaults
+    graph['links'] = len(tree.links)
+    graph['connects'] += graph['links']
+    return graph
+
+
+class Planner:
+
+    def __init__(self, scene, profile, options):
+        self.scene = scene
+        self.profile = profile
+        self.ctx = export_cycles.ExportContext(options)
+        self.geometry = set() # keys of meshes written once, already counted
+        self.materials = {}
+        self.objects = []
+
+    def entry(self, name):
+        entry = { 'name': name, 'verts': 0, 'faces': 0, 'uvs': 0, 'curves': 0, 'keys': 0,
+                  'instances': 0, 'floats': 0, 'indices': 0, 'evaluated': False }
+        self.objects.append(entry)
+        return entry
+
+    def add_materials(self, obj):
+        for material in export_cycles.object_materials(obj):
+            if material is not None and material.name not in self.materials:
+                self.materials[material.name] = material_graph(material)
+
+    def add_mesh(self, entry, obj, key=None):
+        ''' obj's geometry to entry, unless key says it was counted already '''
+        if key is not None:
+            if key in self.geometry:
+                return
+            self.geometry.add(key)
+        ctx = self.ctx
+        if export_cycles.is_curve(ctx, obj):
+            P, radius, nkeys = export_cycles.curve_arrays(obj.data)
+            self.add_curves(entry, len(nkeys), len(radius))
+            return
+        if obj.type == 'MESH':
+            verts, faces, corners = modified_counts(obj, ctx.settings)
+            uv = bool(obj.data.uv_layers)
+        else:
+            # text, surfaces and curves turned into meshes are evaluated
+            mesh = export_cycles.evaluate_mesh(ctx, obj, self.scene)
+            verts, faces, corners = len(mesh.vertices), len(mesh.polygons), len(mesh.loops)
+            uv = bool(mesh.uv_layers)
+            bpy.data.meshes.remove(mesh)
+            entry['evaluated'] = True
+        budget = export_cycles.face_budget(ctx, obj, self.scene)
+        if budget is not None and faces > budget:
+            # collapsed to triangles
+            verts = verts * budget // faces
+            faces, corners = budget, 3 * budget
+        if ctx.options['triangles']:
+            faces, corners = corners - 2 * faces, 3 * (corners - 2 * faces)
+        entry['verts'] += verts
+        entry['faces'] += faces
+        entry['uvs'] += corners if uv else 0
+        entry['floats'] += 3 * verts + (2 * corners if uv else 0) + (
+            3 * verts if ctx.options['normals'] else 0)
+        entry['indices'] += faces + corners
+
+    def add_curves(self, entry, curves, keys):
+        entry['curves'] += curves
+        entry['keys'] += keys
+        entry['floats'] += 4 * keys
+        entry['indices'] += curves
+
+    def add_duplis(self, entry, obj):
+        ''' the instances obj makes, and their geometry once, like gen_duplis() '''
+        obj.dupli_list_create(self.scene, self.ctx.settings)
+        try:
+            sources = {}
+            for dupli in obj.dupli_list:
+                if not dupli.hide:
+                    sources[dupli.object] = sources.get(dupli.object, 0) + 1
+        finally:
+            obj.dupli_list_clear()
+        for source, count in sources.items():
+            if source.type not in ('MESH','CURVE','FONT','SURFACE'):
+                continue
+            self.add_materials(source)
+            entry['instances'] += count
+            self.add_mesh(entry, source, ('DUPLI', source))
+
+    def add_object(self, obj, name=None, key=None):
+        entry = self.entry(name or obj.name)
+        self.add_materials(obj)
+        if export_cycles.is_curve(self.ctx, obj):
+            # written with every object, like gen_object_body()
+            self.add_mesh(entry, obj)
+        elif obj.type in ('MESH','CURVE','FONT','SURFACE'):
+            self.add_mesh(entry, obj, export_cycles.instance_key(self.ctx, obj, key))
+            # hair belongs to the object, not to its possibly shared mesh
+            for psys in export_cycles.hair_systems(self.ctx, obj):
+                self.add_curves(entry, len(psys.particles),
+                                sum(len(p.hair_keys) for p in psys.particles))
+        return entry
+
+    def run(self):
+        ''' walks the scene like gen_scene_objects(), each object by the
+            parts export_cycles.object_parts() writes it as '''
+        scene = self.scene
+        culled = export_cycles.view_culler(self.ctx, scene)
+        skipped = []
+        for obj in scene.objects:
+            if not export_cycles.is_exported(obj, scene):
+                continue
+            if culled is not None and culled(obj):
+                skipped.append(obj.name)
+                continue
+            for part, source, name, matrix, key in export_cycles.object_parts(obj):
+                if part == 'duplis':
+                    self.add_duplis(self.entry(name), source)
+                else:
+                    self.add_object(source, name, key)
+        if scene.world is not None:
+            self.materials.setdefault(scene.world.name, material_graph(scene.world))
+        return skipped
+
+    def cost(self, entry):
+        ''' bytes and seconds of an object's entry '''
+        p = self.profile
+        instances = entry['instances']
+        objects = 0 if instances else 1
+        entry['bytes'] = int(objects * p['object_bytes'] + instances * p['instance_bytes'] +
+                             entry['floats'] * p['float_bytes'] +
+                             entry['indices'] * p['index_bytes'])
+        entry['seconds'] = (objects * p['seconds_per_object'] +
+                            instances * p['seconds_per_instance'] +
+                            (entry['floats'] + entry['indices']) * p['seconds_per_value'])
+
+    def report(self, skipped, flag_seconds, flag_bytes):
+        p = self.profile
+        for entry in self.objects:
+            self.cost(entry)
+        for graph in self.materials.values():
+            elements = graph['elements'] + graph['connects']
+            graph['bytes'] = int(elements * p['node_bytes'])
+            graph['seconds'] = elements * p['seconds_per_node']
+
+        total = { key: sum(entry[key] for entry in self.objects)
+                  for key in ('verts', 'faces', 'uvs', 'curves', 'keys', 'instances',
+                              'bytes', 'seconds') }
+        total['objects'] = len(self.objects)
+        total['materials'] = len(self.materials)
+        total['nodes'] = sum(graph['nodes'] for graph in self.materials.values())
+        total['bytes'] += int(p['scene_bytes']) + sum(
+            graph['bytes'] for graph in self.materials.values())
+        total['seconds'] += sum(graph['seconds'] for graph in self.materials.values())
+        return {
+            'objects'  : self.objects,
+            'materials': self.materials,
+            'culled'   : skipped,
+            'total'    : total,
+            'flagged'  : [entry['name'] for entry in self.objects
+                          if entry['seconds'] > flag_seconds or entry['bytes'] > flag_bytes],
+        }
+
+
+def plan_scene(scene, profile=None, flag_seconds=60.0, flag_bytes=1 << 30, **options):
+    ''' what exporting scene with options would write, per object and in
+        total: vertex, face, uv, curve and instance counts, material graph
+        sizes, and projected bytes and seconds. profile is a dict or the
+        path of a saved one; objects projected to take more than
+        flag_seconds or flag_bytes are listed under 'flagged' '''
+    start = time.perf_counter()
+    if not isinstance(profile, dict):
+        profile = load_profile(profile)
+    planner = Planner(scene, profile, options)
+    report = planner.report(planner.run(), flag_seconds, flag_bytes)
+    report['plan_seconds'] = time.perf_counter() - start
+    return report
+
+
+def _markup_bytes(element):
+    ''' bytes of element without its arrays, indentation and line ends '''
+    size = 2 * len(element.tag) + 5 + sum(
+        len(k) + len(v) + 4 for k, v in element.attrib.items()
+        if k not in _float_arrays and k not in _index_arrays)
+    return size + sum(_markup_bytes(child) for child in element)
+
+
+def measure_output(filepath):
+    ''' bytes written by an export, split between array values, shaders,
+        objects, instances and the rest, read back from its files '''
+    m = { 'bytes': os.path.getsize(filepath), 'floats': 0, 'float_chars': 0,
+          'indices': 0, 'index_chars': 0, 'node_markup': 0, 'nodes': 0,
+          'object_markup': 0, 'objects': 0, 'instance_markup': 0, 'instances': 0,
+          'scene_markup': 0 }
+    seen = set()
+
+    def arrays(element):
+        for child in element.iter():
+            if child.tag == 'include':
+                path = validate.include_path(filepath, child)
+                if path not in seen:
+                    seen.add(path)
+                    m['bytes'] += os.path.getsize(path)
+                    for included in validate.parse_include(filepath, child):
+                        arrays(included)
+            for name in _float_arrays:
+                if name in child.attrib:
+                    m['floats'] += validate.count(child.get(name))
+                    m['float_chars'] += len(child.get(name))
+            for name in _index_arrays:
+                if name in child.attrib:
+                    m['indices'] += validate.count(child.get(name), int)
+                    m['index_chars'] += len(child.get(name))
+
+    for element, path in validate.records(filepath):
+        arrays(element)
+        markup = _markup_bytes(element)
+        children = [child.tag for child in element]
+        if element.tag in ('shader', 'background'):
+            m['node_markup'] += markup
+            m['nodes'] += len(element)
+        elif element.tag == 'transform' and children == ['include']:
+            m['instance_markup'] += markup
+            m['instances'] += 1
+        elif element.tag == 'transform' and children != ['camera']:
+            m['object_markup'] += markup
+            m['objects'] += 1
+        else:
+            m['scene_markup'] += markup
+    return m
+
+
+def calibrate(scene, filepath, save=None, **options):
+    ''' a profile measured by exporting scene to filepath with options, and
+        saved as json to save when given; the scene should be like the ones
+        the profile will plan, with objects, instances and materials '''
+    # timed without stats, which slow the export down, then with them to
+    # split the time between stages
+    start = time.perf_counter()
+    export_cycles.export_scene(filepath, scene, **dict(options, stats=False))
+    seconds = time.perf_counter() - start
+    report = export_cycles.export_scene(filepath, scene, **dict(options, stats=True))['stats']
+    m = measure_output(filepath)
+    stages = report['stages']
+    profile = dict(DEFAULT_PROFILE)
+
+    values = m['floats'] + m['indices']
+    if m['floats']:
+        profile['float_bytes'] = m['float_chars'] / m['floats']
+    if m['indices']:
+        profile['index_bytes'] = m['index_chars'] / m['indices']
+    # indentation and line ends are spread over the markup
+    markup = (m['node_markup'] + m['object_markup'] + m['instance_markup'] +
+              m['scene_markup'])
+    scale = (m['bytes'] - m['float_chars'] - m['index_chars']) / max(1, markup)
+    for kind, count in (('node', 'nodes'), ('object', 'objects'), ('instance', 'instances')):
+        if m[count]:
+            profile[kind + '_bytes'] = scale * m[kind + '_markup'] / m[count]
+    profile['scene_bytes'] = scale * m['scene_markup']
+
+    mesh_seconds = sum(stages.get(stage, 0.0) for stage in
+                       ('to_mesh', 'decimate', 'read_mesh', 'format_mesh', 'format_curves'))
+    if values:
+        profile['seconds_per_value'] = mesh_seconds / values
+    if m['nodes']:
+        profile['seconds_per_node'] = stages.get('materials', 0.0) / m['nodes']
+    instanced = [entry for entry in report['objects'].values() if entry.get('instances')]
+    instance_seconds = sum(entry['seconds'] - sum(entry.get(stage, 0.0) for stage in
+                           ('to_mesh', 'decimate', 'read_mesh', 'format_mesh', 'format_curves'))
+                           for entry in instanced)
+    if m['instances']:
+        profile['seconds_per_instance'] = max(0.0, instance_seconds) / m['instances']
+    rest = report['seconds'] - mesh_seconds - stages.get('materials', 0.0) - instance_seconds
+    if m['objects']:
+        profile['seconds_per_object'] = max(0.0, rest) / m['objects']
+    for key in profile:
+        if key.startswith('seconds_per_'):
+            profile[key] *= seconds / report['seconds']
+
+    saved = { 'profile': profile, 'measured': m, 'options': options }
+    if save is not None:
+        with open(save, 'w') as fp:
+            json.dump(saved, fp, indent=1, sort_keys=True)
+    return profile
@@ -0,0 +1,157 @@
+
+# Timings and counters of an export, collected when its stats option is set.
+#
+# Time is spent in stages (evaluating meshes, reading and formatting them,
+# translating materials ...), and each stage is also accounted to the object
+# or material it was spent on, so one pathological asset stands out in the
+# report. Generators are timed by the time spent in their next() calls, which
+# leaves out the time the consumer, writing the file, spends in between.
+
+import cProfile
+import json
+import sys
+import threading
+import time
+
+from . import util
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb():
+    ''' peak resident memory of the process, None where it can't be known '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+class ExportStats:
+
+    def __init__(self, filepath, profile_path=None):
+        self.filepath = filepath
+        self.profile_path = profile_path
+        self.profile = None
+        if profile_path is not None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.objects = {}
+        self.materials = {}
+        self.culled = [] # objects left out by view culling
+        self.current = None # name of the object being exported
+        self.lock = threading.Lock() # counted from worker threads too
+
+    def add(self, stage, seconds, name=None, table=None, key=None):
+        ''' accounts seconds to stage, and to the current object (under key,
+            the stage by default) or to the entry `name` of table '''
+        if table is None:
+            table, name = self.objects, name or self.current
+            key = key or stage
+        else:
+            key = key or 'seconds'
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            if name is not None:
+                entry = table.setdefault(name, {})
+                entry[key] = entry.get(key, 0.0) + seconds
+
+    def count(self, counter, amount=1, name=None):
+        ''' adds amount to counter, and to the current object's or `name`'s '''
+        name = name or self.current
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+            if name is not None:
+                entry = self.objects.setdefault(name, {})
+                entry[counter] = entry.get(counter, 0) + amount
+
+    def timed(self, stage, node):
+        ''' yields from node, accounting the time its items take to stage '''
+        node = iter(node)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(node)
+            except StopIteration:
+                return
+            finally:
+                self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def timed_object(self, name, node):
+        ''' yields from node, the export of object `name`, which is the
+            current object while node runs '''
+        node = iter(node)
+        while True:
+            current, self.current = self.current, name
+            start = time.perf_counter()
+            try:
+                item = next(node)
+            except StopIteration:
+                return
+            finally:
+                self.add('objects', time.perf_counter() - start, name, key='seconds')
+                self.current = current
+            yield item
+
+    def counted(self, counter, node, name=None):
+        ''' yields from node, counting the size of its items; futures are
+            counted once they are done '''
+        name = name or self.current
+        for item in node:
+            if isinstance(item, str):
+                self.count(counter, len(item), name)
+            else:
+                item.add_done_callback(
+                    lambda job: self.count(counter, len(job.result()), name))
+            yield item
+
+    def close(self, textures=None, slowest=10):
+        ''' writes the report, and the profile, and returns the report;
+            textures is the report of the export's TextureEncoder '''
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_path)
+        if textures is not None:
+            self.stages['textures'] = textures['seconds']
+        objects = sorted(self.objects.items(),
+                         key=lambda item: item[1].get('seconds', 0.0), reverse=True)
+        report = {
+            'seconds'     : time.perf_counter() - self.start,
+            'peak_rss_mb' : peak_rss_mb(),
+            'stages'      : self.stages,
+            'counters'    : self.counters,
+            'slowest'     : [name for name, entry in objects[:slowest]],
+            'objects'     : self.objects,
+            'materials'   : self.materials,
+            'culled'      : self.culled,
+            'textures'    : textures,
+            'profile'     : self.profile_path,
+        }
+        util.write_file(self.filepath, json.dumps(report, indent=1, sort_keys=True))
+        return report
+
+
+class Timer:
+    ''' context manager accounting the time spent in it to a stage, does
+        nothing without stats '''
+
+    def __init__(self, stats, stage, name, table):
+        self.args = (stage, name, table)
+        self.stats = stats
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.stats is None:
+            return
+        stage, name, table = self.args
+        self.stats.add(stage, time.perf_counter() - self.start, name, table)
@@ -0,0 +1,166 @@
+
+# Images inlined into the exported file as base64 encoded PNGs.
+#
+# Each image is encoded once per export, and the result is kept on disk
+# so later exports can reuse it: under the hash of the path and bytes of an
+# unmodified image file, or of the size and pixels of an image only blender
+# holds.
+# Reading, hashing and base64 encoding happen on worker threads; only the
+# work that needs blender's API runs on the calling thread.
+
+import array
+import base64
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from . import util
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'cycles_xml', 'textures')
+
+
+def image_path(image):
+    path = image.filepath_raw
+    if path.startswith('//'):
+        path = path[2:]
+    return path
+
+
+def file_digest(filepath, data):
+    ''' cache key of the image file at filepath holding data '''
+    h = hashlib.sha1(os.path.abspath(filepath).encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+def pixel_digest(image, pixels):
+    ''' cache key of image's pixels, which alone do not tell its size '''
+    w, h = image.size
+    digest = hashlib.sha1(repr((w, h, image.channels)).encode())
+    digest.update(pixels)
+    return digest.hexdigest()
+
+
+class TextureEncoder:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE, workers=4):
+        self.cache_dir = cache_dir
+        self.tmpdir = tempfile.mkdtemp(prefix='cycles_export_')
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.jobs = {}
+        self.seconds = 0.0 # spent on the calling thread
+        self.encoded = 0
+        self.cached = 0
+
+    def request(self, image):
+        ''' starts encoding image, once per export '''
+        key = image.name
+        if key not in self.jobs:
+            start = time.perf_counter()
+            source = self.image_file(image)
+            if source is not None and image.file_format == 'PNG':
+                self.jobs[key] = self.pool.submit(self.encode_file, source)
+            else:
+                # other formats are converted to PNG, by blender, on a miss only
+                if source is not None:
+                    with open(source, 'rb') as fp:
+                        digest = file_digest(source, fp.read())
+                    pixels = None
+                else:
+                    pixels = self.read_pixels(image)
+                    digest = pixel_digest(image, pixels)
+                cached = self.cache_path(digest)
+                if os.path.exists(cached):
+                    self.jobs[key] = self.pool.submit(self.read_cached, cached)
+                else:
+                    if pixels is None:
+                        pixels = self.read_pixels(image)
+                    filepath = self.save_png(image, pixels, digest)
+                    self.jobs[key] = self.pool.submit(self.encode_file, filepath, digest)
+            self.seconds += time.perf_counter() - start
+        return self.jobs[key]
+
+    def inline(self, image):
+        ''' the base64 encoded PNG of image '''
+        job = self.request(image)
+        start = time.perf_counter()
+        data = job.result()
+        self.seconds += time.perf_counter() - start
+        return data
+
+    def close(self):
+        ''' waits for the workers and returns a report '''
+        self.pool.shutdown(wait=True)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        return {
+            'images'  : len(self.jobs),
+            'encoded' : self.encoded,
+            'cached'  : self.cached,
+            'bytes'   : sum(len(job.result()) for job in self.jobs.values()
+                            if job.exception() is None),
+            'seconds' : self.seconds,
+        }
+
+    def cache_path(self, digest):
+        return os.path.join(self.cache_dir, digest + '.b64')
+
+    def image_file(self, image):
+        ''' path of the file an unmodified image was loaded from, None if
+            only blender holds its pixels '''
+        import bpy
+        if image.source != 'FILE' or image.packed_file is not None or image.is_dirty:
+            return None
+        filepath = bpy.path.abspath(image.filepath_raw, library=image.library)
+        if not os.path.isfile(filepath):
+            return None
+        return filepath
+
+    def read_pixels(self, image):
+        if hasattr(image.pixels, 'foreach_get'):
+            pixels = util.float_buffer(len(image.pixels))
+            image.pixels.foreach_get(pixels)
+            return pixels
+        # older blenders only copy in bulk through slicing
+        return array.array('f', image.pixels[:])
+
+    def save_png(self, image, pixels, digest):
+        import bpy
+        w, h = image.size
+        filepath = os.path.join(self.tmpdir, digest + '.png')
+        copy = bpy.data.images.new(digest, width=w, height=h, alpha=True)
+        try:
+            if hasattr(copy.pixels, 'foreach_set'):
+                copy.pixels.foreach_set(pixels)
+            else:
+                copy.pixels[:] = pixels.tolist()
+            copy.file_format = 'PNG'
+            copy.filepath_raw = filepath
+            copy.save()
+        finally:
+            bpy.data.images.remove(copy)
+        return filepath
+
+    # worker threads
+
+    def encode_file(self, filepath, digest=None):
+        with open(filepath, 'rb') as fp:
+            data = fp.read()
+        if digest is None:
+            digest = file_digest(filepath, data)
+            cached = self.cache_path(digest)
+            if os.path.exists(cached):
+                return self.read_cached(cached)
+
+        encoded = base64.b64encode(data).decode('ascii')
+        self.encoded += 1
+        os.makedirs(self.cache_dir, exist_ok=True)
+        util.write_file(self.cache_path(digest), encoded)
+        return encoded
+
+    def read_cached(self, filepath):
+        self.cached += 1
+        with open(filepath) as fp:
+            return fp.read()
@@ -1,19 +1,184 @@
+import array
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import threading
+import xml.sax.saxutils
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
 
 def coroutine(func):
     def starter(*argv, **kwarg):
         gen = func(*argv, **kwarg)
         next(gen)
         return gen
+    starter.__wrapped__ = func
     return starter
 
 
+# bytes collected before anything is handed to the file
+WRITE_BUDGET = 1 << 20
+
+compressors = {
+        '.gz' : lambda path: gzip.open(path, 'wt', compresslevel=1),
+        '.xz' : lambda path: lzma.open(path, 'wt', preset=0),
+        }
+
+
+def compression_ext(filepath):
+    ''' '.gz' for scene.xml.gz, '' when filepath is not compressed '''
+    ext = os.path.splitext(filepath)[1]
+    return ext if ext in compressors else ''
+
+
+def open_output(filepath):
+    ''' filepath opened for writing text, or a Sink when it is already open '''
+    if not isinstance(filepath, (str, os.PathLike)):
+        return Sink(filepath)
+    opener = compressors.get(compression_ext(filepath))
+    if opener is not None:
+        return opener(filepath)
+    return open(filepath, 'w')
+
+
+class Sink:
+    ''' text writes to an open text or binary file, pipe or socket, which
+        is flushed but left open once written '''
+
+    def __init__(self, sink):
+        self.sink = sink
+        if hasattr(sink, 'sendall'):
+            self.send = lambda data: sink.sendall(data.encode())
+        elif isinstance(sink, io.TextIOBase):
+            self.send = sink.write
+        else:
+            self.send = lambda data: sink.write(data.encode())
+
+    def write(self, data):
+        self.send(data)
+
+    def writelines(self, chunks):
+        data = ''.join(chunks)
+        if data:
+            self.send(data)
+
+    def flush(self):
+        if hasattr(self.sink, 'flush'):
+            self.sink.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+# sent to a writer(): hand what it holds to the file now
+FLUSH = object()
+
+
 @coroutine
-def writer(filepath):
-    with open(filepath, 'w') as fp:
-        while True:
-            data = yield
-            if not data : break
-            fp.write(data)
+def writer(filepath, budget=WRITE_BUDGET):
+    ''' writes what it is sent to filepath, or to an open sink, `budget`
+        bytes at a time '''
+    with open_output(filepath) as fp:
+        chunks = []
+        size = 0
+        try:
+            while True:
+                data = yield
+                if data is FLUSH:
+                    fp.writelines(chunks)
+                    fp.flush()
+                    chunks = []
+                    size = 0
+                    continue
+                if not data : break
+                chunks.append(data)
+                size += len(data)
+                if size >= budget:
+                    fp.writelines(chunks)
+                    chunks = []
+                    size = 0
+        finally:
+            fp.writelines(chunks)
+
+
+def write_file(filepath, data):
+    # write next to the target and rename, so an interrupted export never
+    # leaves a partial file behind under its final name
+    tmppath = filepath + '.tmp%d' % os.getpid()
+    with open_output(tmppath + compression_ext(filepath)) as fp:
+        fp.write(data)
+    os.replace(tmppath + compression_ext(filepath), filepath)
+
+
+class IncludeWriter:
+    ''' writes include files named after the hash of their content,
+        from a pool of worker threads; once `budget` bytes are queued,
+        the caller writes the file itself '''
+
+    def __init__(self, dirpath, workers=4, ext='.xml', budget=None):
+        self.dirpath = dirpath
+        self.ext = ext
+        self.budget = budget
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.pending = []
+        self.written = set()
+        self.queued = 0
+        self.lock = threading.Lock() # written to from the pool's threads too
+
+    def write(self, data):
+        ''' queue data and return the file name it will be written to '''
+        name = hashlib.sha1(data.encode()).hexdigest() + self.ext
+        with self.lock:
+            if name in self.written:
+                return name
+            self.written.add(name)
+        filepath = os.path.join(self.dirpath, name)
+        if os.path.exists(filepath):
+            return name
+
+        os.makedirs(self.dirpath, exist_ok=True)
+        with self.lock:
+            queue = self.budget is None or self.queued + len(data) <= self.budget
+            if queue:
+                self.queued += len(data)
+        if queue:
+            self.pending.append(self.pool.submit(self.write_queued, filepath, data))
+        else:
+            write_file(filepath, data)
+        return name
+
+    def write_queued(self, filepath, data):
+        try:
+            write_file(filepath, data)
+        finally:
+            with self.lock:
+                self.queued -= len(data)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        for job in self.pending:
+            job.result()  # re-raise write errors
+
+
+def xml_escape(value):
+    return xml.sax.saxutils.escape(value, {'"': '&quot;'})
 
 
 def write_vector(v):
@@ -33,3 +198,101 @@ def space_separated_matrix(matrix):
     return ' '.join(space_separated_float4(row) + ' ' for row in matrix)
 
 
+# bulk buffers for foreach_get(), numpy backed when available
+
+def float_buffer(size):
+    if numpy is not None:
+        return numpy.zeros(size, dtype=numpy.float32)
+    return array.array('f', bytes(4*size))
+
+def int_buffer(size):
+    if numpy is not None:
+        return numpy.zeros(size, dtype=numpy.int32)
+    return array.array('i', bytes(4*size))
+
+def offsets(counts):
+    ''' start offset of every item of a ragged array, plus the end '''
+    if numpy is not None:
+        result = numpy.zeros(len(counts)+1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=result[1:])
+        return result.tolist()
+    result = [0]
+    total = 0
+    for c in counts:
+        total += c
+        result.append(total)
+    return result
+
+
+# handing arrays to worker processes
+
+def share(values, typecode):
+    ''' copy of values, as typecode items, that unshare() can read back in
+        another process; in shared memory when available '''
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        data = memoryview(numpy.ascontiguousarray(values, numpy.dtype(typecode))).cast('B')
+    else:
+        data = memoryview(array.array(typecode, values)).cast('B')
+
+    if shared_memory is None or not len(data):
+        return (typecode, bytes(data), len(data))
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    return (typecode, shm, len(data))
+
+def start_sharing():
+    ''' starts the tracker share() registers shared memory with, so that
+        processes forked afterwards use it too rather than each starting
+        its own, which would free the memory when the process exits '''
+    if shared_memory is not None:
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
+def unshare(shared):
+    typecode, data, size = shared
+    values = array.array(typecode)
+    if isinstance(data, bytes):
+        values.frombytes(data)
+    else:
+        values.frombytes(data.buf[:size])
+        data.close()
+    return values
+
+def release(shared):
+    ''' frees what share() allocated, once the other side is done '''
+    data = shared[1]
+    if not isinstance(data, bytes):
+        data.close()
+        data.unlink()
+
+
+def ordered(items, window=1, budget=None):
+    ''' passes items through, replacing futures by their result in order;
+        only waits on the oldest future once more than window are pending,
+        or their `nbytes` add up to more than budget '''
+    queue = collections.deque()
+    pending = 0
+    held = 0
+    for item in items:
+        queue.append(item)
+        if isinstance(item, concurrent.futures.Future):
+            pending += 1
+            held += getattr(item, 'nbytes', 0)
+        while queue:
+            head = queue[0]
+            if isinstance(head, concurrent.futures.Future):
+                if not head.done() and pending <= window and (
+                        budget is None or held <= budget):
+                    break
+                pending -= 1
+                held -= getattr(head, 'nbytes', 0)
+                head = head.result()
+            queue.popleft()
+            yield head
+    for item in queue:
+        yield resolved(item)
+
+def resolved(item):
+    if isinstance(item, concurrent.futures.Future):
+        return item.result()
+    return item
@@ -0,0 +1,398 @@
+
+# Checks exported xml files, and compares two exports, without loading them
+# whole: only the element of <cycles> being read (an object, a shader) and
+# the include files it refers to are held in memory.
+#
+# usage: python io_scene_cycles/validate.py FILE.xml [FILE.xml ...]
+#        python io_scene_cycles/validate.py --diff A.xml B.xml [--rtol 1e-5]
+#
+# Validating reports mismatched tags (unbalanced <transform> or <state>),
+# <state> using a shader not defined before it, <connect> from or to a node
+# its shader doesn't have, and <mesh> or <curves> arrays whose lengths don't
+# agree (P, nverts, verts, UV, N; P, radius, nkeys). Includes are followed,
+# relative to the main file as cycles does, and checked once each.
+#
+# Diffing compares the two exports element by element of <cycles>, in order,
+# so an object's difference is reported against its position in the scene;
+# shaders are compared by name, wherever they are. Numbers are equal within
+# the tolerances, and an <include> equals what it includes, so exports
+# written with different output profiles, include settings or workers can be
+# compared. Both exit with status 1 when anything was found.
+
+import argparse
+import itertools
+import os
+import re
+import sys
+import xml.etree.ElementTree as etree
+
+_token = re.compile(r'\S+')
+
+# elements of <cycles> compared by name rather than by position
+_named = ('shader',)
+
+
+def tokens(text):
+    ''' the whitespace separated tokens of text, one at a time '''
+    return (m.group() for m in _token.finditer(text))
+
+
+def count(text, convert=float):
+    ''' how many numbers text holds; ValueError if a token is not one '''
+    n = 0
+    for t in tokens(text):
+        convert(t)
+        n += 1
+    return n
+
+
+def summary(text, convert=int):
+    ''' (count, sum, min, max) of the numbers of text, in one pass; min and
+        max are None when there are none '''
+    n = total = 0
+    low = high = None
+    for t in tokens(text):
+        value = convert(t)
+        n += 1
+        total += value
+        if low is None or value < low:
+            low = value
+        if high is None or value > high:
+            high = value
+    return n, total, low, high
+
+
+def records(filepath, base=None, errors=None):
+    ''' (element, filepath) of every child of filepath's root, top level
+        includes followed; base is the main file, which includes are
+        relative to. Parse errors are appended to errors, raised without '''
+    base = base or filepath
+    parser = etree.iterparse(filepath, events=('start', 'end'))
+    root = None
+    depth = 0
+    try:
+        for event, element in parser:
+            if event == 'start':
+                if depth == 0:
+                    root = element
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1:
+                continue
+            if element.tag == 'include':
+                yield from records(include_path(base, element), base, errors)
+            else:
+                yield element, filepath
+            # done with it
+            root.clear()
+    except (etree.ParseError, OSError) as e:
+        if errors is None:
+            raise
+        errors.append('%s: %s' % (filepath, e))
+
+
+def include_path(base, element):
+    return os.path.join(os.path.dirname(base), element.get('src', ''))
+
+
+def parse_include(base, element):
+    ''' the children of the root of the file element includes '''
+    return list(etree.parse(include_path(base, element)).getroot())
+
+
+def describe(element, index=None):
+    ''' a name for element of <cycles> to report it by '''
+    if element.get('name') is not None:
+        return '<%s name="%s">' % (element.tag, element.get('name'))
+    label = '<%s>' % element.tag
+    if index is not None:
+        label = '#%d %s' % (index, label)
+    state = element.find('state')
+    if state is not None and state.get('shader') is not None:
+        label += ' shader="%s"' % state.get('shader')
+    include = element.find('.//include')
+    if include is not None:
+        label += ' include="%s"' % include.get('src')
+    return label
+
+
+class Validator:
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.problems = []
+        self.shaders = set()
+        self.includes = set() # checked already
+
+    def problem(self, where, text):
+        self.problems.append('%s: %s' % (where, text))
+
+    def run(self):
+        ''' the problems found in the file '''
+        errors = []
+        for index, (element, filepath) in enumerate(records(self.filepath, errors=errors)):
+            self.check(element, '%s %s' % (filepath, describe(element, index)))
+        self.problems.extend(errors)
+        return self.problems
+
+    def check(self, element, where):
+        if element.tag in ('shader', 'background'):
+            self.check_shader(element, where)
+            if element.tag == 'shader':
+                self.shaders.add(element.get('name'))
+            return
+        for child in element.iter():
+            if child.tag == 'state':
+                shader = child.get('shader')
+                if shader is not None and shader not in self.shaders:
+                    self.problem(where, 'state uses shader "%s", not defined before it' % shader)
+            elif child.tag == 'transform':
+                try:
+                    valid = count(child.get('matrix', '')) == 16
+                except ValueError:
+                    valid = False
+                if not valid:
+                    self.problem(where, 'transform matrix is not 16 numbers')
+            elif child.tag == 'mesh':
+                self.check_mesh(child, where)
+            elif child.tag == 'curves':
+                self.check_curves(child, where)
+            elif child.tag == 'include':
+                self.check_include(child, where)
+
+    def check_include(self, element, where):
+        filepath = include_path(self.filepath, element)
+        if filepath in self.includes:
+            return
+        self.includes.add(filepath)
+        try:
+            children = parse_include(self.filepath, element)
+        except (etree.ParseError, OSError) as e:
+            self.problem(where, 'include "%s": %s' % (element.get('src'), e))
+            return
+        for child in children:
+            self.check(child, '%s <%s>' % (filepath, child.tag))
+
+    def check_shader(self, element, where):
+        names = { child.get('name') for child in element if child.tag != 'connect' }
+        names.add('output')
+        for connect in element.iter('connect'):
+            for end in ('from', 'to'):
+                node = connect.get(end, '').split(' ', 1)[0]
+                if node not in names:
+                    self.problem(where, 'connect %s "%s", which is not a node of the shader'
+                                        % (end, connect.get(end)))
+
+    def check_mesh(self, element, where):
+        try:
+            P = count(element.get('P', ''))
+            faces, corners, fewest, _ = summary(element.get('nverts', ''))
+            verts, _, lowest, highest = summary(element.get('verts', ''))
+            UV = count(element.get('UV', '')) if 'UV' in element.attrib else None
+            N = count(element.get('N', '')) if 'N' in element.attrib else None
+        except ValueError as e:
+            self.problem(where, 'mesh: %s' % e)
+            return
+        if P % 3:
+            self.problem(where, 'mesh has %d P values, not a multiple of 3' % P)
+        if corners != verts:
+            self.problem(where, 'mesh nverts add up to %d, but there are %d verts'
+                                % (corners, verts))
+        if faces and fewest < 3:
+            self.problem(where, 'mesh has faces of fewer than 3 vertices')
+        if verts and (lowest < 0 or highest >= P // 3):
+            self.problem(where, 'mesh verts index outside the %d vertices' % (P // 3))
+        if UV is not None and UV != 2*verts:
+            self.problem(where, 'mesh has %d UV values for %d face corners' % (UV, verts))
+        if N is not None and N != P:
+            self.problem(where, 'mesh has %d N values for %d P values' % (N, P))
+
+    def check_curves(self, element, where):
+        try:
+            P = count(element.get('P', ''))
+            radius = count(element.get('radius', ''))
+            _, keys, _, _ = summary(element.get('nkeys', ''))
+        except ValueError as e:
+            self.problem(where, 'curves: %s' % e)
+            return
+        if P % 3:
+            self.problem(where, 'curves have %d P values, not a multiple of 3' % P)
+        if keys != P // 3:
+            self.problem(where, 'curves nkeys add up to %d, but there are %d keys'
+                                % (keys, P // 3))
+        if radius != P // 3:
+            self.problem(where, 'curves have %d radius values for %d keys' % (radius, P // 3))
+
+
+def validate(filepath):
+    ''' the problems found in the export at filepath, empty when valid '''
+    return Validator(filepath).run()
+
+
+class Differ:
+
+    def __init__(self, a, b, rtol=1e-6, atol=1e-6, limit=5):
+        self.paths = (a, b)
+        self.rtol = rtol
+        self.atol = atol
+        self.limit = limit # differences reported per element
+        self.compared = {} # (include a, include b) -> differences
+
+    def close(self, x, y):
+        return abs(x - y) <= self.atol + self.rtol * abs(y)
+
+    def attribute(self, name, x, y, where, out):
+        if x == y:
+            return
+        if x is None or y is None:
+            out.append('%s: %s only in %s' % (where, name, 'a' if y is None else 'b'))
+            return
+        count = 0
+        first = None
+        extra = [0, 0]
+        for i, (tx, ty) in enumerate(itertools.zip_longest(tokens(x), tokens(y))):
+            if tx == ty:
+                continue
+            if tx is None or ty is None:
+                extra[tx is None] += 1
+                continue
+            try:
+                same = self.close(float(tx), float(ty))
+            except ValueError:
+                same = False
+            if not same:
+                count += 1
+                if first is None:
+                    first = (i, tx, ty)
+        for side, more in zip('ab', extra):
+            if more:
+                out.append('%s: %s has %d more values in %s' % (where, name, more, side))
+        if count:
+            out.append('%s: %s differs at %d values, first at %d: %s != %s' % (
+                (where, name, count) + first))
+
+    def children(self, elements, base):
+        ''' elements, with includes replaced by what they include '''
+        for element in elements:
+            if element.tag == 'include':
+                yield from self.included(element, base)
+            else:
+                yield element
+
+    def included(self, element, base):
+        try:
+            return parse_include(base, element)
+        except (etree.ParseError, OSError) as e:
+            return [etree.Element('unreadable', { 'src': element.get('src'), 'error': str(e) })]
+
+    def element(self, a, b, where, out):
+        if a.tag == 'include' and b.tag == 'include':
+            # the same pair of includes, e.g. of instances, is compared once
+            key = (include_path(self.paths[0], a), include_path(self.paths[1], b))
+            if key not in self.compared:
+                self.compared[key] = []
+                self.pairs(self.included(a, self.paths[0]), self.included(b, self.paths[1]),
+                           where, self.compared[key])
+            out.extend(self.compared[key])
+            return
+        if a.tag != b.tag:
+            out.append('%s: <%s> in a, <%s> in b' % (where, a.tag, b.tag))
+            return
+        where += ' ' + a.tag
+        for name in sorted(set(a.attrib) | set(b.attrib)):
+            self.attribute(name, a.get(name), b.get(name), where, out)
+        xs, ys = list(a), list(b)
+        if [x.tag for x in xs] != [y.tag for y in ys]:
+            # e.g. a mesh written inline on one side, to an include on the other
+            xs = list(self.children(xs, self.paths[0]))
+            ys = list(self.children(ys, self.paths[1]))
+        self.pairs(xs, ys, where, out)
+
+    def pairs(self, xs, ys, where, out):
+        if len(xs) != len(ys):
+            out.append('%s: %d elements in a, %d in b' % (where, len(xs), len(ys)))
+        for x, y in zip(xs, ys):
+            self.element(x, y, where, out)
+
+    def run(self):
+        ''' yields (element description, differences) of every element of
+            <cycles> that differs '''
+        shaders = ({}, {})
+        a = records(self.paths[0])
+        b = records(self.paths[1])
+        index = 0
+        while True:
+            x = next_unnamed(a, shaders[0])
+            y = next_unnamed(b, shaders[1])
+            if x is None and y is None:
+                break
+            if x is None or y is None:
+                yield describe(x or y, index), ['only in %s' % ('a' if y is None else 'b')]
+            else:
+                diff = []
+                self.element(x, y, describe(x, index), diff)
+                if diff:
+                    yield describe(x, index), diff[:self.limit] + (
+                        ['... %d more' % (len(diff) - self.limit)] if len(diff) > self.limit else [])
+            index += 1
+        for key in sorted(set(shaders[0]) | set(shaders[1]), key=str):
+            x, y = shaders[0].get(key), shaders[1].get(key)
+            label = '<%s name="%s">' % key
+            if x is None or y is None:
+                yield label, ['only in %s' % ('a' if y is None else 'b')]
+                continue
+            diff = []
+            self.element(x, y, label, diff)
+            if diff:
+                yield label, diff[:self.limit]
+
+
+def next_unnamed(records, named):
+    ''' the next element of records not compared by name; those are kept
+        in named, by tag and name '''
+    for element, filepath in records:
+        if element.tag not in _named:
+            return element
+        named[(element.tag, element.get('name'))] = element
+    return None
+
+
+def diff(a, b, **tolerances):
+    ''' (element description, differences) of every element of <cycles>
+        that differs between the exports at a and b '''
+    return Differ(a, b, **tolerances).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Checks or compares exported cycles xml')
+    parser.add_argument('files', nargs='+', metavar='FILE.xml')
+    parser.add_argument('--diff', action='store_true', help='compare two exports')
+    parser.add_argument('--rtol', type=float, default=1e-6, help='relative tolerance of numbers')
+    parser.add_argument('--atol', type=float, default=1e-6, help='absolute tolerance of numbers')
+    parser.add_argument('--limit', type=int, default=5, help='differences shown per element')
+    args = parser.parse_args(argv)
+
+    found = 0
+    if args.diff:
+        if len(args.files) != 2:
+            parser.error('--diff compares exactly two files')
+        for label, differences in diff(*args.files, rtol=args.rtol, atol=args.atol,
+                                       limit=args.limit):
+            found += 1
+            print(label)
+            for line in differences:
+                print('    ' + line)
+        print('%d elements differ' % found)
+    else:
+        for filepath in args.files:
+            problems = validate(filepath)
+            found += len(problems)
+            for problem in problems:
+                print(problem)
+            print('%s: %d problems' % (filepath, len(problems)))
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())